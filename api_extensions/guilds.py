@@ -2,11 +2,14 @@ import logging
 
 import discord
 from discord import Guild
+from .resolver import Resolver
 from discord.ext.commands import Bot
 from typing import Optional
 
 logger = logging.getLogger("api_extensions.guilds")
 
+_resolver: Resolver[int, Guild] = Resolver("guild")
+
 
 async def get_guild(guild_id: int | str, bot: Bot) -> Optional[Guild]:
     """
@@ -15,20 +18,20 @@ async def get_guild(guild_id: int | str, bot: Bot) -> Optional[Guild]:
     :param bot: The bot to fetch the guild from.
     :return: The Guild, as a Discord object, or None if it doesn't exist.
     """
-    guild = bot.get_guild(int(guild_id))
-    if guild:
-        logger.debug(f"Got guild {guild_id} ({guild.name}) from the cache.")
-        return guild
+    guild_id = int(guild_id)
+    return await _resolver.resolve(guild_id, lambda: bot.get_guild(guild_id), lambda: _fetch_guild(guild_id, bot))
+
 
+async def _fetch_guild(guild_id: int, bot: Bot) -> Optional[Guild]:
     try:
         guild = await bot.fetch_guild(guild_id)
     except discord.NotFound:
         # This isn't (yet) a runtime error, since the guild could've been deleted while the bot is running.
-        logger.warning(f"Guild {guild_id} doesn't exist. Please check your config.")
+        logger.warning("Guild %s doesn't exist. Please check your config.", guild_id)
         return None
     except discord.HTTPException as e:
-        logger.critical(f"An unknown error occurred when fetching guild {guild_id}. Please check your environment.")
+        logger.critical("An unknown error occurred when fetching guild %s. Please check your environment.", guild_id)
         raise RuntimeError(e)
 
-    logger.debug(f"Fetched guild {guild_id} ({guild.name}) from the Discord API.")
+    logger.debug("Fetched guild %s (%s) from the Discord API.", guild_id, guild.name)
     return guild
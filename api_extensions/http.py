@@ -0,0 +1,34 @@
+import functools
+import logging
+
+from discord.ext.commands import Bot
+from telemetry.metrics import Histogram
+
+logger = logging.getLogger("api_extensions.http")
+
+DISCORD_LATENCY = Histogram("discord_request_duration_seconds",
+                            "Time taken by Discord REST API requests, including time spent waiting on rate limits.",
+                            labels=("method", "route"))
+
+
+def instrument(bot: Bot) -> None:
+    """
+    Records how long each Discord REST API request made by the bot takes.
+    Requests are labelled by their route template (e.g. /guilds/{guild_id}/members/{user_id}), rather than the
+    requested path, so the number of label sets stays small.
+    :param bot: The bot whose HTTP client should be instrumented. Safe to call more than once.
+    """
+    http = bot.http
+    if getattr(http.request, "_instrumented", False):
+        return
+
+    request = http.request
+
+    @functools.wraps(request)
+    async def timed_request(route, **kwargs):
+        with DISCORD_LATENCY.time(method=route.method, route=route.path):
+            return await request(route, **kwargs)
+
+    timed_request._instrumented = True
+    http.request = timed_request
+    logger.debug("Instrumented Discord REST API requests")
@@ -1,11 +1,16 @@
+import asyncio
 import logging
 
 import discord
-from discord import Guild, Member
-from typing import Optional
+from datetime import datetime
+from .resolver import Resolver
+from discord import Guild, Member, Role
+from typing import Optional, Sequence, Tuple
 
 logger = logging.getLogger("api_extensions.members")
 
+_resolver: Resolver[Tuple[int, int], Member] = Resolver("member")
+
 
 async def get_member(member_id: int | str, guild: Guild) -> Optional[Member]:
     """
@@ -14,24 +19,95 @@ async def get_member(member_id: int | str, guild: Guild) -> Optional[Member]:
     :param guild: The guild to fetch the member from.
     :return: The member, as a Discord object, or None if it doesn't exist.
     """
-    member = guild.get_member(int(member_id))
-    if member:
-        logger.debug(f"Got member {member_id} ({member.name}) from the cache.")
-        return member
+    member_id = int(member_id)
+    return await _resolver.resolve((guild.id, member_id),
+                                   lambda: guild.get_member(member_id),
+                                   lambda: _fetch_member(member_id, guild))
+
+
+def role_ids(member: Member) -> Sequence[int]:
+    """
+    :return: The IDs of the member's roles (excluding the default role), without building Role objects like
+        Member.roles does. discord.py replaces this array whenever the member's roles change.
+    """
+    # Member._roles is private, so it's only read here.
+    return member._roles
+
 
+async def _fetch_member(member_id: int, guild: Guild) -> Optional[Member]:
     try:
         member = await guild.fetch_member(member_id)
-    except discord.Forbidden:
-        # This isn't (yet) a runtime error. since the guild could've just kicked the bot.
-        logger.warning(f"Bot does not have access to guild {guild.id} ({guild.name}).")
-        raise None
+    except discord.Forbidden as e:
+        # The guild could've just kicked the bot.
+        logger.warning("Bot does not have access to guild %s (%s).", guild.id, guild.name)
+        raise RuntimeError(e)
     except discord.NotFound:
         # This isn't (yet) a runtime error, since the member could've left the guild.
-        logger.warning(f"Member {member} doesn't exist. Did they leave?")
+        logger.warning("Member %s doesn't exist. Did they leave?", member_id)
         return None
     except discord.HTTPException as e:
-        logger.critical(f"An unknown error occurred when fetching member {member_id}. Please check your environment.")
+        logger.critical("An unknown error occurred when fetching member %s. Please check your environment.", member_id)
         raise RuntimeError(e)
 
-    logger.debug(f"Fetched member {member.id} ({member.name}) from the Discord API.")
+    logger.debug("Fetched member %s (%s) from the Discord API.", member.id, member.name)
     return member
+
+
+async def timeout_with_role(member: Member, until: datetime, role: Optional[Role], reason: str) -> bool:
+    """
+    Times a member out and adds a role to them, with both requests sent concurrently.
+    The role is added on its own (a PUT of that one role), rather than by sending the member's full roles list, since the
+    bot's copy of the member can be out of date: roles granted or removed by others in the meantime would be reverted.
+    If the role can't be added (e.g. the bot isn't allowed to, or the request fails), the member is still timed out.
+    :param member: The member to time out.
+    :param until: When the timeout ends.
+    :param role: The role to add, or None to only time the member out.
+    :param reason: The reason shown in the audit log.
+    :return: Whether the member has the role.
+    """
+    add_role = role is not None and role not in member.roles
+    requests = [member.edit(timed_out_until=until, reason=reason)]
+    if add_role:
+        requests.append(member.add_roles(role, reason=reason))
+    timed_out, *role_added = await asyncio.gather(*requests, return_exceptions=True)
+
+    if isinstance(timed_out, BaseException):
+        if add_role and not isinstance(role_added[0], BaseException):
+            # Nothing will remove the role once the timeout is abandoned, so take it back now.
+            await _remove_role(member, role, reason="Timeout could not be applied")
+        if not isinstance(timed_out, discord.HTTPException):
+            raise timed_out
+        logger.critical("Unable to time out member %s (%s).", member.id, member.name)
+        raise RuntimeError(timed_out)
+    logger.debug("Timed out member %s (%s).", member.id, member.name)
+
+    if not add_role:
+        return role is not None
+    error = role_added[0]
+    if isinstance(error, discord.Forbidden):
+        logger.warning("Bot can't add role %s (%s) to member %s (%s). Applied the timeout only.",
+                       role.id, role.name, member.id, member.name)
+        return False
+    if isinstance(error, discord.HTTPException):
+        # The member is timed out either way, so the roll still goes ahead without the role.
+        logger.critical("An unknown error occurred when adding role %s to member %s. Please investigate! %s",
+                        role.id, member.id, error)
+        return False
+    if isinstance(error, BaseException):
+        raise error
+    logger.debug("Added role %s (%s) to member %s (%s).", role.id, role.name, member.id, member.name)
+    return True
+
+
+async def _remove_role(member: Member, role: Role, reason: str) -> None:
+    try:
+        await member.remove_roles(role, reason=reason)
+    except discord.HTTPException as e:
+        logger.critical("Unable to remove role %s from member %s (%s): %s", role.id, member.id, member.name, e)
+
+
+def forget_missing_member(member_id: int, guild: Guild) -> None:
+    """
+    Forgets that a member doesn't exist, e.g. after they rejoin the guild.
+    """
+    _resolver.forget((guild.id, member_id))
@@ -0,0 +1,103 @@
+"""
+A shared layer for resolving Discord objects by ID, used by the helpers in this package.
+
+Each lookup checks discord.py's cache first. On a cache miss:
+- Concurrent fetches for the same ID are merged, so only one REST request is sent and every caller gets its result.
+- IDs that turned out not to exist (e.g. a member that left, or a deleted role) are remembered for a short time, so
+  repeated lookups don't go back to the API.
+"""
+import asyncio
+import logging
+import time
+
+from cachetools import TTLCache
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# How long IDs that don't exist are remembered for.
+_NEGATIVE_TTL_SECONDS = 30
+_NEGATIVE_CACHE_SIZE = 10000
+
+logger = logging.getLogger("api_extensions.resolver")
+
+
+class Resolver(Generic[K, V]):
+    def __init__(self, name: str, negative_ttl: float = _NEGATIVE_TTL_SECONDS):
+        self.name = name
+        self._in_flight: Dict[K, asyncio.Task] = dict()
+        self._missing: TTLCache = TTLCache(maxsize=_NEGATIVE_CACHE_SIZE, ttl=negative_ttl, timer=time.monotonic)
+        self._counters: Dict[str, int] = dict.fromkeys(("hits", "misses", "negative_hits", "fetches", "merged"), 0)
+        _resolvers[name] = self
+
+    @property
+    def counters(self) -> Dict[str, int]:
+        """
+        :return: A copy of this resolver's counters:
+            hits: Lookups answered by discord.py's cache.
+            negative_hits: Lookups answered by the cache of IDs that don't exist.
+            misses: Lookups that needed a fetch.
+            fetches: REST requests sent.
+            merged: Lookups that waited on another lookup's request, rather than sending their own.
+        """
+        return dict(self._counters)
+
+    async def resolve(self,
+                      key: K,
+                      cached: Callable[[], Optional[V]],
+                      fetch: Callable[[], Awaitable[Optional[V]]]) -> Optional[V]:
+        """
+        :param key: The ID (or other key) being looked up.
+        :param cached: Looks the object up in discord.py's cache.
+        :param fetch: Fetches the object from the API, returning None if it doesn't exist.
+        :return: The object, or None if it doesn't exist.
+        """
+        value = cached()
+        if value is not None:
+            self._counters["hits"] += 1
+            return value
+
+        if key in self._missing:
+            self._counters["negative_hits"] += 1
+            logger.debug("%s %s is known not to exist.", self.name, key)
+            return None
+
+        self._counters["misses"] += 1
+        task = self._in_flight.get(key)
+        if task:
+            self._counters["merged"] += 1
+        else:
+            self._counters["fetches"] += 1
+            task = self._in_flight[key] = asyncio.create_task(self._fetch(key, fetch))
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # Shield the request, so one caller being cancelled doesn't cancel it for everyone else.
+        return await asyncio.shield(task)
+
+    def forget(self, key: K) -> None:
+        """
+        Forgets that an ID doesn't exist, e.g. after a member rejoins.
+        """
+        self._missing.pop(key, None)
+
+    def _finish(self, key: K, task: asyncio.Task) -> None:
+        self._in_flight.pop(key, None)
+        # Errors are raised to every waiting caller. Mark them as retrieved, in case every caller was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, key: K, fetch: Callable[[], Awaitable[Optional[V]]]) -> Optional[V]:
+        value = await fetch()
+        if value is None:
+            self._missing[key] = True
+        return value
+
+
+_resolvers: Dict[str, Resolver] = dict()
+
+
+def counters() -> Dict[str, Dict[str, int]]:
+    """
+    :return: The counters of every resolver, keyed by resolver name.
+    """
+    return {name: resolver.counters for name, resolver in _resolvers.items()}
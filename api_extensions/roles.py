@@ -1,11 +1,14 @@
 import logging
 
 import discord
+from .resolver import Resolver
 from discord import Guild, Role
-from typing import Optional
+from typing import Optional, Tuple
 
 logger = logging.getLogger("api_extensions.roles")
 
+_resolver: Resolver[Tuple[int, int], Role] = Resolver("role")
+
 
 async def get_role(role_id: int | str, guild: Guild) -> Optional[Role]:
     """
@@ -14,23 +17,24 @@ async def get_role(role_id: int | str, guild: Guild) -> Optional[Role]:
     :param guild: The guild to fetch the role from.
     :return: The role, as a Discord object, or None if the role doesn't exist.
     """
+    role_id = int(role_id)
+    return await _resolver.resolve((guild.id, role_id),
+                                   lambda: guild.get_role(role_id),
+                                   lambda: _fetch_role(role_id, guild))
 
-    role = guild.get_role(int(role_id))
-    if role:
-        logger.debug(f"Got role {role_id} ({role.name}) from cache.")
-        return role
 
+async def _fetch_role(role_id: int, guild: Guild) -> Optional[Role]:
     # If the role isn't in the cache, attempt to fetch it from the API
-    logger.debug(f"Didn't find role {role_id}, requesting from API...")
+    logger.debug("Didn't find role %s, requesting from API...", role_id)
     try:
         role = await guild.fetch_role(role_id)
     except discord.NotFound:
         # This isn't (yet) a runtime error, since the role could've been deleted while the bot is running.
-        logger.warning(f"Role {role_id} doesn't exist. Please check your config.")
+        logger.warning("Role %s doesn't exist. Please check your config.", role_id)
         return None
     except discord.HTTPException as e:
-        logger.critical(f"An unknown error occurred when fetching role {role_id}. Please check your environment.")
+        logger.critical("An unknown error occurred when fetching role %s. Please check your environment.", role_id)
         raise RuntimeError(e)
 
-    logger.debug(f"Fetched role {role_id} ({role.name}) from the Discord API.")
+    logger.debug("Fetched role %s (%s) from the Discord API.", role_id, role.name)
     return role
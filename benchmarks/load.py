@@ -0,0 +1,389 @@
+"""
+Synthetic load benchmark for the Roll and Unmute cogs.
+
+Drives Roll.on_message and Unmute.unmute_tick with fake guilds, members and messages, against an in-process Redis
+stand-in (fakeredis), so throughput can be compared across commits without touching Discord. Discord API calls (edits,
+replies) complete immediately, or after --api-latency milliseconds. Randomness (the corpus, rolled durations and reply
+texts) is seeded.
+
+Each scenario is run twice: once for timing, then again (with fresh members) under tracemalloc for allocations.
+
+Scenarios:
+    chatter     Messages in an observed channel that don't match a roll pattern.
+    debounced   A few members spamming rolls, so all but their first roll are debounced.
+    self_rolls  Members rolling for themselves, once each.
+    moderator   Moderators rolling for several mentioned members at once.
+    unmute      Large backlogs of due unmutes, cleared by a single unmute tick each.
+
+Usage: python -m benchmarks.load [--scenario NAME ...] [--messages N] [--backlog N] [--repeat N] [--api-latency MS]
+                                [--seed S]
+Requires fakeredis (pip install fakeredis). Run from the repository root, so settings.toml is found.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+# The benchmark's settings, applied as environment variables (see config.py) unless they're already set.
+_SETTINGS = {
+    "roulette_guild": "81384788765712384",
+    "roulette_guilds": ["81384788765712384"],
+    "roulette_channels": ["1"],
+    "roulette_timeout_role": "10",
+    "roulette_protected_roles": ["11"],
+    "roulette_moderator_roles": ["12"],
+    "roulette_administrator_users": ["13"],
+    "roulette_roll_match_patterns": [r"(?i)^roll$", r"(?i)^/roll\b"],
+    "roulette_roll_debounce_backend": "local",
+    "roulette_roll_debounce_seconds": 60,
+    "roulette_roll_timeout_response_delay_seconds": 0,
+    # Stats events are written to the outbox, but never sent (the dispatcher isn't started).
+    "roulette_roll_timeout_leaderboard_webhook_urls": ["http://127.0.0.1:9/leaderboard"],
+    "roulette_guild_overrides": {}
+}
+for _key, _value in _SETTINGS.items():
+    os.environ.setdefault(f"ROULETTE_{_key.upper()}", f"@json {json.dumps(_value)}")
+
+from discord import Member  # noqa: E402
+from extensions.roulette import keys, timeouts  # noqa: E402
+from extensions.roulette.config import settings  # noqa: E402
+from extensions.roulette.roll.cog import Roll  # noqa: E402
+from extensions.roulette.unmute.cog import Unmute  # noqa: E402
+from extensions.roulette.unmute.scheduler import UnmuteScheduler  # noqa: E402
+from database.redis_client import close_redis, get_redis, init_redis  # noqa: E402
+
+_CHANNEL_ID = 1
+_BOT_USER_ID = 2
+_TIMEOUT_ROLE_ID = 10
+_MODERATOR_ROLE_ID = 12
+# Member and message IDs are never reused, even across scenarios, since the cogs cache state (e.g. permission tiers and
+# cooldowns) by ID.
+_ids = itertools.count(1_000_000)
+_CHATTER = ("lol", "anyone playing tonight?", "gg", "that roller coaster was wild", "rolled my ankle again",
+            "<@123456789> did you see this", "based", "https://example.com/some/long/link?ref=chat", "💀💀💀")
+
+
+class _FakeRole:
+    def __init__(self, role_id: int, name: str, default: bool = False):
+        self.id = role_id
+        self.name = name
+        self._default = default
+
+    def is_default(self) -> bool:
+        return self._default
+
+    def __eq__(self, other):
+        return isinstance(other, _FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class _FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.bot = True
+
+
+class _FakeMember(Member):
+    """
+    A Member with just enough state for the cogs. Subclassing Member keeps the cogs' isinstance checks meaningful.
+    """
+
+    def __init__(self, member_id: int, guild: "_FakeGuild", roles: Sequence[_FakeRole], api_latency: float):
+        self.guild = guild
+        self._id = member_id
+        self._fake_roles = [guild.default_role, *roles]
+        self._api_latency = api_latency
+
+    id = property(lambda self: self._id)
+    name = property(lambda self: f"member{self._id}")
+    display_name = property(lambda self: f"Member {self._id}")
+    bot = property(lambda self: False)
+    roles = property(lambda self: list(self._fake_roles))
+    # Role IDs, excluding the default role, like discord.py's own Member._roles (read through members.role_ids).
+    _roles = property(lambda self: sorted(role.id for role in self._fake_roles[1:]))
+
+    async def edit(self, *, roles: Optional[List[_FakeRole]] = None, **_):
+        await asyncio.sleep(self._api_latency)
+        if roles is not None:
+            self._fake_roles = [self.guild.default_role, *roles]
+
+    async def add_roles(self, *roles: _FakeRole, **_):
+        await asyncio.sleep(self._api_latency)
+        self._fake_roles.extend(role for role in roles if role not in self._fake_roles)
+
+    async def remove_roles(self, *roles: _FakeRole, **_):
+        await asyncio.sleep(self._api_latency)
+        self._fake_roles = [role for role in self._fake_roles if role not in roles]
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self._id
+
+    def __hash__(self):
+        return hash(self._id)
+
+    def __repr__(self):
+        return f"<FakeMember id={self._id}>"
+
+
+class _FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = "Benchmark Guild"
+        self.chunked = True
+        self.default_role = _FakeRole(guild_id, "@everyone", default=True)
+        self._roles = {role.id: role for role in (_FakeRole(_TIMEOUT_ROLE_ID, "timeout"),
+                                                  _FakeRole(_MODERATOR_ROLE_ID, "moderator"))}
+        self._members: Dict[int, _FakeMember] = dict()
+
+    def get_role(self, role_id: int) -> Optional[_FakeRole]:
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id: int) -> Optional[_FakeMember]:
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id: int):
+        return None
+
+    def add_members(self, member_ids: Sequence[int], roles: Sequence[_FakeRole], api_latency: float) -> List[_FakeMember]:
+        added = [_FakeMember(member_id, self, roles, api_latency) for member_id in member_ids]
+        self._members.update((member.id, member) for member in added)
+        return added
+
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+
+class _FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+
+    def typing(self) -> _Typing:
+        return _Typing()
+
+
+class _FakeMessage:
+    def __init__(self, message_id: int, content: str, author: _FakeMember, channel: _FakeChannel,
+                 mentions: Sequence[_FakeMember], api_latency: float):
+        self.id = message_id
+        self.content = content
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel
+        self.mentions = list(mentions)
+        self.reference = None
+        self.replies = 0
+        self._api_latency = api_latency
+
+    async def reply(self, content: str, **_):
+        await asyncio.sleep(self._api_latency)
+        self.replies += 1
+
+
+class _FakeBot:
+    def __init__(self, guild: _FakeGuild, unmute: Callable[[], Optional[Unmute]]):
+        self.user = _FakeUser(_BOT_USER_ID)
+        self.shard_id = None
+        self.shard_count = None
+        self._guild = guild
+        self._unmute = unmute
+
+    def get_guild(self, guild_id: int) -> Optional[_FakeGuild]:
+        return self._guild if guild_id == self._guild.id else None
+
+    def dispatch(self, event: str, *args):
+        # Only the Unmute cog listens to Roulette's own events.
+        cog = self._unmute()
+        if event == "roulette_timeout_recorded" and cog:
+            asyncio.create_task(cog.on_roulette_timeout_recorded(*args))
+
+
+@dataclass
+class _Result:
+    operations: int
+    seconds: float
+    latencies: List[float]
+    replies: int
+
+
+class _Allocations:
+    """
+    Traces allocations made during the measured sections of a run (excluding building the fake members and messages).
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.peak = 0
+        self.retained = 0
+
+    @contextmanager
+    def measure(self) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.peak = max(self.peak, peak)
+            self.retained += current
+
+
+class _Harness:
+    def __init__(self, api_latency: float, allocations: _Allocations):
+        self.api_latency = api_latency
+        self.allocations = allocations
+        self.guild = _FakeGuild(settings.current().guild_id)
+        self.channel = _FakeChannel(_CHANNEL_ID)
+        self.unmute: Optional[Unmute] = None
+        self.bot = _FakeBot(self.guild, lambda: self.unmute)
+        self.roll = Roll(self.bot)
+        self.unmute = Unmute(self.bot)
+        self.unmute.schedulers[0] = UnmuteScheduler()
+
+    def members(self, count: int, roles: Sequence[_FakeRole] = ()) -> List[_FakeMember]:
+        return self.guild.add_members([next(_ids) for _ in range(count)], roles, self.api_latency)
+
+    def message(self, content: str, author: _FakeMember, mentions: Sequence[_FakeMember] = ()) -> _FakeMessage:
+        return _FakeMessage(next(_ids), content, author, self.channel, mentions, self.api_latency)
+
+    async def run_messages(self, messages: List[_FakeMessage]) -> _Result:
+        latencies = list()
+        with self.allocations.measure():
+            started = time.perf_counter()
+            for message in messages:
+                sent = time.perf_counter()
+                await self.roll.on_message(message)
+                latencies.append(time.perf_counter() - sent)
+            elapsed = time.perf_counter() - started
+        return _Result(len(messages), elapsed, latencies, sum(message.replies for message in messages))
+
+    async def run_unmute(self, backlog: int) -> _Result:
+        timed_out = self.members(backlog, roles=(self.guild.get_role(_TIMEOUT_ROLE_ID),))
+        due = time.time() - 60
+        unmute_time = datetime.fromtimestamp(due, timezone.utc)
+        await asyncio.gather(*(timeouts.record(self.guild.id, member.id, unmute_time, 5, member.id, next(_ids))
+                               for member in timed_out))
+        scheduler = self.unmute.schedulers[0]
+        for member in timed_out:
+            scheduler.schedule((self.guild.id, member.id), due)
+
+        with self.allocations.measure():
+            started = time.perf_counter()
+            await self.unmute.unmute_tick(0)
+            elapsed = time.perf_counter() - started
+
+        remaining = await get_redis().zcard(keys.timeouts(self.guild.id))
+        if remaining:
+            raise AssertionError(f"{remaining} unmutes were left in Redis after the tick")
+        return _Result(backlog, elapsed, [elapsed], 0)
+
+
+def _chatter(harness: _Harness, rng: random.Random, count: int) -> List[_FakeMessage]:
+    authors = harness.members(200)
+    return [harness.message(rng.choice(_CHATTER), rng.choice(authors)) for _ in range(count)]
+
+
+def _debounced(harness: _Harness, rng: random.Random, count: int) -> List[_FakeMessage]:
+    spammers = harness.members(5)
+    return [harness.message(rng.choice(("roll", "/roll now")), rng.choice(spammers)) for _ in range(count)]
+
+
+def _self_rolls(harness: _Harness, rng: random.Random, count: int) -> List[_FakeMessage]:
+    return [harness.message("roll", author) for author in harness.members(count)]
+
+
+def _moderator(harness: _Harness, rng: random.Random, count: int) -> List[_FakeMessage]:
+    moderators = harness.members(10, roles=(harness.guild.get_role(_MODERATOR_ROLE_ID),))
+    targets = harness.members(500)
+    return [harness.message("roll", rng.choice(moderators), rng.sample(targets, 5)) for _ in range(count)]
+
+
+_MESSAGE_SCENARIOS = {
+    "chatter": _chatter,
+    "debounced": _debounced,
+    "self_rolls": _self_rolls,
+    "moderator": _moderator
+}
+_SCENARIOS = (*_MESSAGE_SCENARIOS, "unmute")
+
+
+async def _run_once(harness: _Harness, scenario: str, args: argparse.Namespace, seed: int) -> _Result:
+    random.seed(seed)
+    await get_redis().flushdb()
+    if scenario == "unmute":
+        results = [await harness.run_unmute(args.backlog) for _ in range(args.repeat)]
+        return _Result(sum(r.operations for r in results),
+                       sum(r.seconds for r in results),
+                       [latency for r in results for latency in r.latencies],
+                       0)
+
+    messages = _MESSAGE_SCENARIOS[scenario](harness, random.Random(seed), args.messages)
+    return await harness.run_messages(messages)
+
+
+def _percentile(samples: List[float], percentile: int) -> float:
+    if len(samples) < 2:
+        return samples[0] if samples else 0.0
+    return statistics.quantiles(samples, n=100, method="inclusive")[percentile - 1]
+
+
+async def run(scenarios: Sequence[str], args: argparse.Namespace) -> None:
+    import fakeredis.aioredis
+
+    init_redis(fakeredis.aioredis.FakeRedis().connection_pool)
+    settings.load()
+    try:
+        print(f"seed {args.seed}, {args.messages} messages per scenario, unmute backlog {args.backlog} x{args.repeat}, "
+              f"API latency {args.api_latency}ms")
+        for scenario in scenarios:
+            timed = await _run_once(_Harness(args.api_latency / 1000, _Allocations(False)), scenario, args, args.seed)
+            allocations = _Allocations(True)
+            await _run_once(_Harness(args.api_latency / 1000, allocations), scenario, args, args.seed)
+            unit = "members/sec" if scenario == "unmute" else "msgs/sec"
+            print(f"{scenario:>12}: {timed.operations / timed.seconds:>10,.0f} {unit:<11}"
+                  f"  p50 {_percentile(timed.latencies, 50) * 1000:>8.3f}ms"
+                  f"  p99 {_percentile(timed.latencies, 99) * 1000:>8.3f}ms"
+                  f"  peak {allocations.peak / 1024:>8,.0f} KiB  retained {allocations.retained / 1024:>8,.0f} KiB"
+                  f"  ({timed.replies} replies)")
+    finally:
+        await close_redis()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", dest="scenarios", choices=_SCENARIOS)
+    parser.add_argument("--messages", type=int, default=5_000)
+    parser.add_argument("--backlog", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5, help="Number of unmute backlogs to clear")
+    parser.add_argument("--api-latency", type=float, default=0, help="Simulated Discord API latency, in milliseconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The cogs log every roll at INFO, which would dominate the measurements.
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(tuple(args.scenarios or _SCENARIOS), args))
+
+
+if __name__ == "__main__":
+    main()
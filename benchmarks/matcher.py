@@ -0,0 +1,89 @@
+"""
+Micro-benchmark for the roll trigger matcher.
+
+Compares searching each pattern in turn (the previous behaviour) against the combined TriggerMatcher, over a seeded,
+synthetic corpus of chat messages where only a small share of messages are rolls.
+
+Usage: python -m benchmarks.matcher [--messages N] [--trigger-rate R] [--seed S] [--pattern REGEX ...]
+"""
+import argparse
+import random
+import re
+import timeit
+
+from extensions.roulette.roll.matcher import TriggerMatcher
+from typing import List, Sequence
+
+_DEFAULT_PATTERNS = (
+    r"^roll$",
+    r"(?i)^/roll\b",
+    r"(?i)\bgacha\b",
+    r"(?i)\bmute ?me\b",
+    r"(?i)^(?:please |pls )?roll(?: me)?[!?.]*$",
+    r"^🎲+$"
+)
+_TRIGGERS = ("roll", "/roll", "gacha time", "mute me", "pls roll me!", "🎲🎲")
+_WORDS = (
+    "the", "a", "is", "it", "that", "lol", "lmao", "what", "why", "yeah", "no", "ok", "i", "you", "we", "this", "game",
+    "stream", "tonight", "anyone", "playing", "roller", "coaster", "rolled", "control", "muted", "meme", "gachapon",
+    "pull", "banner", "rates", "wtf", "gg", "nice", "based", "cringe", "true", "real", "😭", "💀", "🔥", "<@123456789>",
+    "https://example.com/some/long/link?ref=chat", "did", "just", "get", "again", "today", "ping", "mods"
+)
+
+
+def build_corpus(count: int, trigger_rate: float, seed: int) -> List[str]:
+    """
+    :return: A list of synthetic chat messages, where roughly trigger_rate of them are roll triggers.
+    """
+    rng = random.Random(seed)
+    corpus = list()
+    for _ in range(count):
+        if rng.random() < trigger_rate:
+            corpus.append(rng.choice(_TRIGGERS))
+        else:
+            # Chat messages are mostly short, with a long tail of longer messages.
+            length = min(int(rng.expovariate(1 / 8)) + 1, 80)
+            corpus.append(" ".join(rng.choice(_WORDS) for _ in range(length)))
+    return corpus
+
+
+def run(patterns: Sequence[str], corpus: Sequence[str], repeat: int) -> None:
+    compiled = tuple(re.compile(p) for p in patterns)
+    matcher = TriggerMatcher(compiled)
+
+    def naive():
+        for content in corpus:
+            for pattern in compiled:
+                if pattern.search(content):
+                    break
+
+    def combined():
+        for content in corpus:
+            matcher.search(content)
+
+    # Sanity check: both approaches must agree on which messages match.
+    mismatches = sum(1 for c in corpus if bool(matcher.search(c)) != any(p.search(c) for p in compiled))
+    if mismatches:
+        raise AssertionError(f"TriggerMatcher disagreed with the naive matcher on {mismatches} message(s)")
+
+    matches = sum(1 for c in corpus if matcher.search(c))
+    print(f"{len(compiled)} patterns, {len(corpus)} messages ({matches} matching)")
+    for name, func in (("naive", naive), ("combined", combined)):
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:>10}: {len(corpus) / best:>12,.0f} messages/sec  {best / len(corpus) * 1e9:>8,.0f} ns/message")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--trigger-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pattern", action="append", dest="patterns")
+    args = parser.parse_args()
+
+    run(args.patterns or _DEFAULT_PATTERNS, build_corpus(args.messages, args.trigger_rate, args.seed), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,137 @@
+from contextlib import contextmanager
 from dynaconf import Dynaconf, Validator
-from typing import Dict, List, Optional
-
-_settings = Dynaconf(
-    envvar_prefix="ROULETTE",
-    environments=True,
-    load_dotenv=True,
-    settings_files=[
-        'settings.toml',
-        '.secrets.toml',
-        'settings.yml',
-        '.secrets.yml'
-    ],
-    validators=[
-        # Bot settings
-        Validator("log_level", is_type_of=str),
-        Validator("bot_token", must_exist=True, is_type_of=str),
-        # Redis settings
-        Validator("redis_host", must_exist=True, is_type_of=str),
-        Validator("redis_port", must_exist=True, is_type_of=int),
-        Validator("redis_username", is_type_of=str),
-        Validator("redis_password", is_type_of=str),
-        # Roulette settings
-        Validator("roulette_guild", must_exist=True, is_type_of=str),
-        Validator("roulette_channels", must_exist=True, is_type_of=list, len_min=1),
-        Validator("roulette_timeout_role", must_exist=True, is_type_of=str),
-        Validator("roulette_protected_roles", is_type_of=list),
-        Validator("roulette_moderator_roles", is_type_of=list),
-        Validator("roulette_administrator_users", is_type_of=list),
-        Validator("roulette_roll_match_patterns", must_exist=True, is_type_of=list, len_min=1),
-        Validator("roulette_roll_timeout_affected_messages_self", must_exist=True, is_type_of=list, len_min=1),
-        Validator("roulette_roll_timeout_affected_messages_other", must_exist=True, is_type_of=list, len_min=1),
-        Validator("roulette_roll_timeout_protected_messages_self", must_exist=True, is_type_of=list, len_min=1),
-        Validator("roulette_roll_timeout_protected_messages_other", must_exist=True, is_type_of=list, len_min=1),
-        Validator("roulette_roll_timeout_leaderboard_webhook_urls", is_type_of=list),
-        Validator("roulette_roll_timeout_response_delay_seconds", is_type_of=int),
-        Validator("roulette_roll_timeout_intervals", must_exist=True, is_type_of=list),
-        Validator("roulette_unmute_rate", is_type_of=int),
-    ]
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+_SETTINGS_FILES = (
+    'settings.toml',
+    '.secrets.toml',
+    'settings.yml',
+    '.secrets.yml'
+)
+
+_VALIDATORS = (
+    # Bot settings
+    Validator("log_level", is_type_of=str),
+    Validator("log_debug_sample_rate", is_type_of=int, gte=1),
+    Validator("bot_token", must_exist=True, is_type_of=str),
+    Validator("bot_gateway_profile", is_in=["default", "lean"]),
+    Validator("bot_max_messages", is_type_of=int, gte=0),
+    Validator("bot_sharded", is_type_of=bool),
+    Validator("bot_shard_count", is_type_of=int, gte=1),
+    Validator("bot_shard_ids", is_type_of=list),
+    # Metrics settings
+    Validator("metrics_host", is_type_of=str),
+    Validator("metrics_port", is_type_of=int, gte=0, lte=65535),
+    Validator("metrics_profiler", is_type_of=bool),
+    Validator("loop_watchdog_threshold_seconds", is_type_of=(int, float), gte=0),
+    # Redis settings
+    Validator("redis_host", must_exist=True, is_type_of=str),
+    Validator("redis_port", must_exist=True, is_type_of=int),
+    Validator("redis_username", is_type_of=str),
+    Validator("redis_password", is_type_of=str),
+    Validator("redis_key_const", is_type_of=str),
+    # Roulette settings
+    Validator("roulette_guild", must_exist=True, is_type_of=str),
+    Validator("roulette_guilds", is_type_of=list),
+    Validator("roulette_guild_overrides", is_type_of=dict),
+    Validator("roulette_channels", must_exist=True, is_type_of=list, len_min=1),
+    Validator("roulette_timeout_role", must_exist=True, is_type_of=str),
+    Validator("roulette_protected_roles", is_type_of=list),
+    Validator("roulette_moderator_roles", is_type_of=list),
+    Validator("roulette_administrator_users", is_type_of=list),
+    Validator("roulette_roll_match_patterns", must_exist=True, is_type_of=list, len_min=1),
+    Validator("roulette_roll_timeout_affected_messages_self", must_exist=True, is_type_of=list, len_min=1),
+    Validator("roulette_roll_timeout_affected_messages_other", must_exist=True, is_type_of=list, len_min=1),
+    Validator("roulette_roll_timeout_protected_messages_self", must_exist=True, is_type_of=list, len_min=1),
+    Validator("roulette_roll_timeout_protected_messages_other", must_exist=True, is_type_of=list, len_min=1),
+    Validator("roulette_roll_timeout_leaderboard_webhook_urls", is_type_of=list),
+    Validator("roulette_roll_timeout_leaderboard_batch_size", is_type_of=int, gte=1),
+    Validator("roulette_roll_timeout_leaderboard_max_attempts", is_type_of=int, gte=1),
+    Validator("roulette_roll_timeout_leaderboard_outbox_size", is_type_of=int, gte=1),
+    Validator("roulette_roll_timeout_response_delay_seconds", is_type_of=int),
+    Validator("roulette_roll_timeout_concurrency", is_type_of=int, gte=1),
+    Validator("roulette_roll_timeout_aggregate_replies", is_type_of=bool),
+    Validator("roulette_roll_timeout_intervals", must_exist=True, is_type_of=list),
+    Validator("roulette_roll_debounce_backend", is_in=["local", "redis"]),
+    Validator("roulette_roll_debounce_seconds", is_type_of=int, gte=0),
+    Validator("roulette_roll_debounce_role_seconds", is_type_of=dict),
+    Validator("roulette_unmute_rate", is_type_of=int),
+    Validator("roulette_unmute_batch_size", is_type_of=int, gte=1),
+    Validator("roulette_unmute_concurrency", is_type_of=int, gte=1),
+    Validator("roulette_slow_trace_seconds", is_type_of=(int, float), gte=0),
+    Validator("roulette_settings_reload_seconds", is_type_of=int, gte=0),
 )
 
 
+def _load() -> Dynaconf:
+    return Dynaconf(
+        envvar_prefix="ROULETTE",
+        environments=True,
+        load_dotenv=True,
+        settings_files=list(_SETTINGS_FILES),
+        validators=list(_VALIDATORS)
+    )
+
+
+_settings = _load()
+
+# Per-guild values that take precedence over the loaded settings (see guild_overrides).
+_overrides: Mapping[str, Any] = dict()
+
+
+@contextmanager
+def reloaded() -> Iterator[None]:
+    """
+    Re-reads all settings files and environment variables into a separate instance, and validates it before it replaces
+    the loaded settings. The new settings are active inside the block, and are rolled back if the block raises (e.g.
+    because they can't be parsed), so readers never see rejected settings once it exits.
+    Example: with reloaded(): rebuild_snapshots()
+    Raises a dynaconf ValidationError if the new settings are invalid, without replacing the loaded settings.
+    """
+    global _settings
+    candidate = _load()
+    candidate.validators.validate()
+    previous, _settings = _settings, candidate
+    try:
+        yield
+    except BaseException:
+        _settings = previous
+        raise
+
+
+def settings_files() -> List[str]:
+    """
+    :return: Paths of the settings files (including their .local variants) that currently exist on disk.
+    """
+    paths = list()
+    for name in _SETTINGS_FILES:
+        stem, _, extension = name.rpartition(".")
+        for candidate in (name, f"{stem}.local.{extension}"):
+            if path := _settings.find_file(candidate):
+                paths.append(path)
+    return paths
+
+
+@contextmanager
+def guild_overrides(overrides: Mapping[str, Any]) -> Iterator[None]:
+    """
+    Temporarily overrides roulette settings, e.g. while building the settings for one guild.
+    Example: with guild_overrides({"roulette_channels": ["123"]}): ...
+    :param overrides: Settings keys (case-insensitive) and the values that replace them.
+    """
+    global _overrides
+    previous = _overrides
+    _overrides = {str(key).lower(): value for key, value in overrides.items()}
+    try:
+        yield
+    finally:
+        _overrides = previous
+
+
+def _get(key: str) -> Any:
+    return _overrides[key] if key in _overrides else _settings.get(key)
+
+
 def log_level() -> str:
     """
     :return: The logging level that should be used for this application. Does not affect Discord.py logging.
@@ -47,6 +139,13 @@ def log_level() -> str:
     return str(_settings.get("log_level", "INFO")).upper()
 
 
+def log_debug_sample_rate() -> int:
+    """
+    :return: Only one in every this many DEBUG records of each event is logged. 1 logs every record.
+    """
+    return _settings.get("log_debug_sample_rate") or 1
+
+
 def bot_token() -> str:
     """
     :return: The bot token, as a string.
@@ -54,6 +153,75 @@ def bot_token() -> str:
     return _settings.get("bot_token")
 
 
+def bot_gateway_profile() -> str:
+    """
+    :return: Which intents and caches the bot uses: "default" or "lean" (see gateway.py).
+    """
+    return _settings.get("bot_gateway_profile") or "default"
+
+
+def bot_max_messages(default: int) -> Optional[int]:
+    """
+    :param default: The value to use if the setting isn't set.
+    :return: The number of messages discord.py keeps in its message cache, or None to disable the cache.
+    """
+    max_messages = _settings.get("bot_max_messages")
+    max_messages = default if max_messages is None else max_messages
+    return max_messages or None
+
+
+def bot_sharded() -> bool:
+    """
+    :return: Whether the bot should run as an AutoShardedBot.
+    """
+    return bool(_settings.get("bot_sharded"))
+
+
+def bot_shard_count() -> Optional[int]:
+    """
+    :return: The total number of shards, or None to use the number Discord recommends.
+    """
+    return _settings.get("bot_shard_count") or None
+
+
+def bot_shard_ids() -> Optional[List[int]]:
+    """
+    :return: The shards this process should run, or None to run all of them.
+    """
+    shard_ids = _settings.get("bot_shard_ids")
+    return [int(shard_id) for shard_id in shard_ids] if shard_ids else None
+
+
+def metrics_host() -> str:
+    """
+    :return: The address the metrics exporter listens on.
+    """
+    return _settings.get("metrics_host") or "127.0.0.1"
+
+
+def metrics_port() -> Optional[int]:
+    """
+    :return: The port the metrics exporter listens on, or None if metrics shouldn't be exported.
+    """
+    return _settings.get("metrics_port") or None
+
+
+def metrics_profiler() -> bool:
+    """
+    :return: Whether the metrics exporter also serves the sampling profiler (at /debug/profile).
+    """
+    return bool(_settings.get("metrics_profiler"))
+
+
+def loop_watchdog_threshold_seconds() -> float:
+    """
+    :return: Time in seconds the event loop can be blocked for before the blocking call is logged, or 0 to disable the
+        watchdog.
+    """
+    threshold = _settings.get("loop_watchdog_threshold_seconds")
+    return 0.25 if threshold is None else threshold
+
+
 def redis_host() -> str:
     """
     :return: The Redis host, as a string.
@@ -83,67 +251,126 @@ def redis_password() -> Optional[str]:
 
 
 def redis_key_const() -> Optional[str]:
+    """
+    :return: The prefix of every guild's Redis keys, or None to use the default prefix.
+    """
     return _settings.get("redis_key_const") or None
 
 
 def roulette_roll_match_patterns() -> List[str]:
-    return _settings.get("roulette_roll_match_patterns")
+    return _get("roulette_roll_match_patterns")
 
 
 def roulette_guild() -> str:
-    return _settings.get("roulette_guild")
+    return _get("roulette_guild")
+
+
+def roulette_guilds() -> Optional[List[str]]:
+    return _get("roulette_guilds") or None
+
+
+def roulette_guild_overrides() -> Optional[Dict]:
+    return _get("roulette_guild_overrides") or None
 
 
 def roulette_channels() -> List[str]:
-    return _settings.get("roulette_channels")
+    return _get("roulette_channels")
 
 
 def roulette_timeout_role() -> Optional[str]:
-    return _settings.get("roulette_timeout_role")
+    return _get("roulette_timeout_role")
 
 
 def roulette_protected_roles() -> Optional[List[str]]:
-    return _settings.get("roulette_protected_roles")
+    return _get("roulette_protected_roles")
 
 
 def roulette_moderator_roles() -> Optional[List[str]]:
-    return _settings.get("roulette_moderator_roles")
+    return _get("roulette_moderator_roles")
 
 
 def roulette_administrator_users() -> Optional[List[str]]:
-    return _settings.get("roulette_administrator_users")
+    return _get("roulette_administrator_users")
 
 
 def roulette_roll_timeout_affected_messages_self() -> List[str]:
-    return _settings.get("roulette_roll_timeout_affected_messages_self")
+    return _get("roulette_roll_timeout_affected_messages_self")
 
 
 def roulette_roll_timeout_affected_messages_other() -> List[str]:
-    return _settings.get("roulette_roll_timeout_affected_messages_other")
+    return _get("roulette_roll_timeout_affected_messages_other")
 
 
 def roulette_roll_timeout_protected_messages_self() -> List[str]:
-    return _settings.get("roulette_roll_timeout_protected_messages_self")
+    return _get("roulette_roll_timeout_protected_messages_self")
 
 
 def roulette_roll_timeout_protected_messages_other() -> List[str]:
-    return _settings.get("roulette_roll_timeout_protected_messages_other")
+    return _get("roulette_roll_timeout_protected_messages_other")
 
 
 def roulette_roll_timeout_leaderboard_webhook_urls() -> Optional[List[str]]:
-    return _settings.get("roulette_roll_timeout_leaderboard_webhook_urls")
+    return _get("roulette_roll_timeout_leaderboard_webhook_urls")
+
+
+def roulette_roll_timeout_leaderboard_batch_size() -> Optional[int]:
+    return _get("roulette_roll_timeout_leaderboard_batch_size") or None
+
+
+def roulette_roll_timeout_leaderboard_max_attempts() -> Optional[int]:
+    return _get("roulette_roll_timeout_leaderboard_max_attempts") or None
+
+
+def roulette_roll_timeout_leaderboard_outbox_size() -> Optional[int]:
+    return _get("roulette_roll_timeout_leaderboard_outbox_size") or None
 
 
 def roulette_roll_timeout_response_delay_seconds() -> Optional[int]:
-    return _settings.get("roulette_roll_timeout_response_delay_seconds")
+    return _get("roulette_roll_timeout_response_delay_seconds")
+
+
+def roulette_roll_timeout_concurrency() -> Optional[int]:
+    return _get("roulette_roll_timeout_concurrency")
+
+
+def roulette_roll_timeout_aggregate_replies() -> Optional[bool]:
+    return _get("roulette_roll_timeout_aggregate_replies")
 
 
 def roulette_roll_timeout_intervals() -> List[Dict]:
-    return _settings.get("roulette_roll_timeout_intervals")
+    return _get("roulette_roll_timeout_intervals")
+
+
+def roulette_roll_debounce_backend() -> Optional[str]:
+    return _get("roulette_roll_debounce_backend") or None
+
+
+def roulette_roll_debounce_seconds() -> Optional[int]:
+    return _get("roulette_roll_debounce_seconds")
+
+
+def roulette_roll_debounce_role_seconds() -> Optional[Dict]:
+    return _get("roulette_roll_debounce_role_seconds")
 
 
 def roulette_unmute_rate() -> Optional[int]:
-    return _settings.get("roulette_unmute_rate") or None
+    return _get("roulette_unmute_rate") or None
+
+
+def roulette_unmute_batch_size() -> Optional[int]:
+    return _get("roulette_unmute_batch_size") or None
+
+
+def roulette_unmute_concurrency() -> Optional[int]:
+    return _get("roulette_unmute_concurrency") or None
+
+
+def roulette_slow_trace_seconds() -> Optional[float]:
+    return _get("roulette_slow_trace_seconds")
+
+
+def roulette_settings_reload_seconds() -> Optional[int]:
+    return _get("roulette_settings_reload_seconds")
 
 # `envvar_prefix` = export envvars with `export ROULETTE_FOO=bar`.
 # `settings_files` = Load these files in the order.
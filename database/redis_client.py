@@ -1,19 +1,77 @@
 import config
-import redis
+import redis.asyncio as redis
 
-_pool = redis.ConnectionPool(
-    host=config.redis_host(),
-    port=config.redis_port()
-)
+from telemetry.metrics import Histogram
+from typing import Any, List, Optional, Sequence
 
+REDIS_LATENCY = Histogram("redis_command_duration_seconds",
+                          "Time taken by Redis commands, including the round trip.",
+                          labels=("command",))
 
-def get_redis():
+_pool: Optional[redis.ConnectionPool] = None
+_client: Optional[redis.Redis] = None
+
+
+class _InstrumentedRedis(redis.Redis):
+    """
+    A Redis client that records how long each command takes. Pipelines are recorded by pipelined().
+    """
+
+    async def execute_command(self, *args, **options):
+        with REDIS_LATENCY.time(command=str(args[0]).upper()):
+            return await super().execute_command(*args, **options)
+
+
+def init_redis(connection_pool: Optional[redis.ConnectionPool] = None) -> redis.Redis:
+    """
+    Creates the shared connection pool and client. This should be called once, when extensions are set up.
+    Credentials are carried on the pool, so every connection it opens is authenticated.
+    :param connection_pool: A pool to use instead of connecting to the configured server, e.g. a stand-in for
+        benchmarks.
+    :return: The shared asyncio Redis client.
+    """
+    global _pool, _client
+    if _client is None:
+        _pool = connection_pool or redis.ConnectionPool(
+            host=config.redis_host(),
+            port=config.redis_port(),
+            username=config.redis_username(),
+            password=config.redis_password()
+        )
+        _client = _InstrumentedRedis(connection_pool=_pool)
+    return _client
+
+
+def get_redis() -> redis.Redis:
+    """
+    :return: A shared asyncio Redis Client that can be used across Cogs. Commands must be awaited.
+    """
+    if _client is None:
+        raise RuntimeError("Redis has not been initialized. Please call init_redis() first.")
+    return _client
+
+
+async def close_redis() -> None:
+    """
+    Closes the shared client and disconnects all pooled connections.
+    """
+    global _pool, _client
+    if _client is not None:
+        await _client.aclose()
+        await _pool.disconnect()
+    _pool = _client = None
+
+
+async def pipelined(*commands: Sequence[Any], transaction: bool = False) -> List[Any]:
     """
-    :return: A shared Redis Client that is thread-safe and can be used across Cogs.
+    Sends several commands to Redis in a single round trip.
+    Example: await pipelined(("ZREM", key, *members), ("DEL", *keys))
+    :param commands: Each command, as a sequence of the command name followed by its arguments.
+    :param transaction: Whether to wrap the commands in MULTI/EXEC, so they're applied atomically.
+    :return: The result of each command, in order.
     """
-    redis_client = redis.Redis(
-        connection_pool=_pool,
-        password=config.redis_password(),
-        username=config.redis_username()
-    )
-    return redis_client
+    async with get_redis().pipeline(transaction=transaction) as pipe:
+        for command in commands:
+            pipe.execute_command(*command)
+        with REDIS_LATENCY.time(command="PIPELINE"):
+            return await pipe.execute()
@@ -17,6 +17,22 @@ def guild() -> str:
     return root_config.roulette_guild()
 
 
+def guilds() -> Tuple[str, ...]:
+    """
+    :return: Every Guild this bot is operating on. The first one is the primary guild.
+    """
+    return tuple(str(g) for g in root_config.roulette_guilds() or (guild(),))
+
+
+def guild_overrides(guild_id: str) -> Dict[str, object]:
+    """
+    :param guild_id: The Guild to get the overrides for.
+    :return: Settings (e.g. roulette_channels) that apply only to a given guild, instead of the shared settings.
+    """
+    overrides = root_config.roulette_guild_overrides() or dict()
+    return dict(overrides.get(str(guild_id)) or dict())
+
+
 def channels() -> Tuple[str]:
     """
     :return:  A list of channel IDs (as strings) representing channels that should be observed.
@@ -56,11 +72,42 @@ def administrator() -> Tuple[str]:
 
 def unmute_rate() -> int:
     """
-    :return: Time in minutes between each unmute loop, as an integer.
+    :return: Time in minutes before retrying failed unmutes, as an integer.
     """
     return root_config.roulette_unmute_rate() or 1
 
 
+def unmute_batch_size() -> int:
+    """
+    :return: The maximum number of due timeouts fetched from Redis per request, as an integer.
+    """
+    return root_config.roulette_unmute_batch_size() or 100
+
+
+def unmute_concurrency() -> int:
+    """
+    :return: The maximum number of members that are unmuted concurrently, as an integer.
+    """
+    return root_config.roulette_unmute_concurrency() or 5
+
+
+def slow_trace_seconds() -> float:
+    """
+    :return: Time in seconds after which a roll or unmute tick is logged as slow, with a breakdown of its stages.
+        0 disables the slow request log.
+    """
+    slow_seconds = root_config.roulette_slow_trace_seconds()
+    return 5 if slow_seconds is None else slow_seconds
+
+
+def settings_reload_seconds() -> int:
+    """
+    :return: Time in seconds between checks for changed settings files, or 0 to disable hot-reloading.
+    """
+    seconds = root_config.roulette_settings_reload_seconds()
+    return 30 if seconds is None else seconds
+
+
 def timeout_role() -> Optional[str]:
     """
     A role that is applied to users to time them out.
@@ -80,8 +127,8 @@ def roll_timeout_affected_messages_self() -> Tuple[str]:
     """
     A list of messages representing bot responses when a user has rolled a mute for themselves.
     Supported inline replacement values:
-    - {timeout_user_name}: The display name of the user (will not be tagged)
-    - {timeout_duration_label}: A display of the user's timeout duration
+    - {user_name} (or {timeout_user_name}): The display name of the user (will not be tagged)
+    - {duration_label} (or {timeout_duration_label}): A display of the user's timeout duration
     """
     return tuple(str(m) for m in root_config.roulette_roll_timeout_affected_messages_self())
 
@@ -90,8 +137,8 @@ def roll_timeout_affected_messages_other() -> Tuple[str]:
     """
     A list of messages representing bot responses when a moderator or administrator rolls a mute for another user.
     Supported inline replacement values:
-    - {timeout_user_name}: The display name of the user (will not be tagged)
-    - {timeout_duration_label}: A display of the user's timeout duration
+    - {user_name} (or {timeout_user_name}): The display name of the user (will not be tagged)
+    - {duration_label} (or {timeout_duration_label}): A display of the user's timeout duration
     """
     return tuple(str(m) for m in root_config.roulette_roll_timeout_affected_messages_other())
 
@@ -101,8 +148,8 @@ def roll_timeout_protected_messages_self() -> Tuple[str]:
     A list of messages representing bot responses when a user has rolled a mute for themselves but is protected from the
         effect, such as a protected role, moderator, or administrator.
     Supported inline replacement values:
-    - {timeout_user_name}: The display name of the user (will not be tagged)
-    - {timeout_duration_label}: A display of the user's timeout duration
+    - {user_name} (or {timeout_user_name}): The display name of the user (will not be tagged)
+    - {duration_label} (or {timeout_duration_label}): A display of the user's timeout duration
     """
     return tuple(str(m) for m in root_config.roulette_roll_timeout_protected_messages_self())
 
@@ -112,8 +159,8 @@ def roll_timeout_protected_messages_other() -> Tuple[str]:
     A list of messages representing bot responses when a user has rolled a mute for another user but that user is
         protected from the effect, e.g. having a protected role, moderator role, or being an administrator.
     Supported inline replacement values:
-    - {timeout_user_name}: The display name of the user (will not be tagged)
-    - {timeout_duration_label}: A display of the user's timeout duration
+    - {user_name} (or {timeout_user_name}): The display name of the user (will not be tagged)
+    - {duration_label} (or {timeout_duration_label}): A display of the user's timeout duration
     """
     return tuple(str(m) for m in root_config.roulette_roll_timeout_protected_messages_other())
 
@@ -127,7 +174,7 @@ def roll_timeout_intervals() -> Tuple[Dict]:
     - bounds["upper"]: Upper bound (inclusive) of the roll value for this interval.
     - weight: An integer indicating the non-cumulative weight (chance) for this interval.
     """
-    # TODO: Maybe consider adding some kind of validation logic here.
+    # The intervals are validated when the settings snapshot is built (see settings._parse_interval).
     return tuple(root_config.roulette_roll_timeout_intervals())
 
 
@@ -138,9 +185,67 @@ def roll_timeout_response_delay_seconds() -> int:
     return root_config.roulette_roll_timeout_response_delay_seconds() or 0
 
 
+def roll_timeout_concurrency() -> int:
+    """
+    :return: The maximum number of targets of a single roll that are timed out at the same time.
+    """
+    return root_config.roulette_roll_timeout_concurrency() or 5
+
+
+def roll_timeout_aggregate_replies() -> bool:
+    """
+    :return: Whether a roll with several targets is answered with one combined reply, rather than one per target.
+    """
+    return bool(root_config.roulette_roll_timeout_aggregate_replies())
+
+
 def roll_timeout_leaderboard_webhook_urls() -> Tuple[str]:
     """
     :return: A list of webhook URLs to send action events post-roll.
     """
     urls = root_config.roulette_roll_timeout_leaderboard_webhook_urls()
     return tuple(str(x) for x in urls) if urls else tuple()
+
+
+def roll_timeout_leaderboard_batch_size() -> int:
+    """
+    :return: The maximum number of events sent to the leaderboard webhooks in a single request.
+    """
+    return root_config.roulette_roll_timeout_leaderboard_batch_size() or 1
+
+
+def roll_timeout_leaderboard_max_attempts() -> int:
+    """
+    :return: The maximum number of attempts to send each batch to a leaderboard webhook, including retries.
+    """
+    return root_config.roulette_roll_timeout_leaderboard_max_attempts() or 5
+
+
+def roll_timeout_leaderboard_outbox_size() -> int:
+    """
+    :return: The approximate maximum number of unsent events kept in the Redis outbox.
+    """
+    return root_config.roulette_roll_timeout_leaderboard_outbox_size() or 10000
+
+
+def roll_debounce_backend() -> str:
+    """
+    :return: Where roll cooldowns are tracked: "redis" (shared by all bot processes) or "local" (this process only).
+    """
+    return root_config.roulette_roll_debounce_backend() or "redis"
+
+
+def roll_debounce_seconds() -> int:
+    """
+    :return: The default time in seconds a user must wait between rolls.
+    """
+    seconds = root_config.roulette_roll_debounce_seconds()
+    return 60 if seconds is None else seconds
+
+
+def roll_debounce_role_seconds() -> Dict[str, int]:
+    """
+    :return: A mapping of role IDs (as strings) to the time in seconds members with that role must wait between rolls.
+    """
+    roles = root_config.roulette_roll_debounce_role_seconds()
+    return {str(role): int(seconds) for role, seconds in roles.items()} if roles else dict()
@@ -0,0 +1,219 @@
+"""
+An immutable, precompiled snapshot of the Roulette settings.
+
+The snapshot is built once when the extension is loaded, so hot paths (e.g. Roll.on_message) only read plain attributes
+instead of going back through Dynaconf. When the settings files change, a new snapshot is built and swapped in as a
+single reference assignment, so readers always see either the old or the new settings - never a mix of both.
+
+There is one snapshot per configured guild (see roulette_guilds), each with that guild's overrides applied. Settings
+that aren't specific to a guild (e.g. the unmute batch size) are read from the primary guild's snapshot.
+"""
+import logging
+
+import config as root_config
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, FrozenSet, List, Mapping, NamedTuple, Optional, Tuple
+
+from . import config
+from ..roll.matcher import TriggerMatcher
+from ..roll.templates import ReplyTemplate, compile_templates
+
+_SUFFIX_MINUTES = {
+    "m": 1,
+    "h": 60,
+    "d": 1440,
+    "w": 10080
+}
+
+logger = logging.getLogger("roulette.settings")
+
+
+class Interval(NamedTuple):
+    """
+    A single timeout interval, with its bounds already converted into minutes.
+    """
+    lower: int  # Inclusive, in minutes
+    upper: int  # Inclusive, in minutes
+    weight: int
+
+
+@dataclass(frozen=True)
+class RouletteSettings:
+    guild_id: int
+    channel_ids: FrozenSet[int]
+    protected_role_ids: FrozenSet[int]
+    moderator_role_ids: FrozenSet[int]
+    administrator_user_ids: FrozenSet[int]
+    timeout_role_id: Optional[int]
+    unmute_rate: int
+    unmute_batch_size: int
+    unmute_concurrency: int
+    slow_trace_seconds: float
+    matcher: TriggerMatcher
+    intervals: Tuple[Interval, ...]
+    affected_messages_self: Tuple[ReplyTemplate, ...]
+    affected_messages_other: Tuple[ReplyTemplate, ...]
+    protected_messages_self: Tuple[ReplyTemplate, ...]
+    protected_messages_other: Tuple[ReplyTemplate, ...]
+    response_delay_seconds: int
+    roll_concurrency: int
+    aggregate_replies: bool
+    debounce_backend: str
+    debounce_seconds: int
+    debounce_role_seconds: Mapping[int, int]
+    leaderboard_webhook_urls: Tuple[str, ...]
+    leaderboard_batch_size: int
+    leaderboard_max_attempts: int
+    leaderboard_outbox_size: int
+
+    @classmethod
+    def build(cls) -> "RouletteSettings":
+        """
+        Builds a snapshot from the currently loaded settings.
+        Raises a ValueError if any of the settings can't be parsed.
+        """
+        timeout_role = config.timeout_role()
+        intervals = tuple(_parse_interval(i) for i in config.roll_timeout_intervals())
+        if not any(interval.weight for interval in intervals):
+            raise ValueError("At least one roll timeout interval must have a positive weight")
+
+        return cls(
+            guild_id=int(config.guild()),
+            channel_ids=frozenset(int(c) for c in config.channels()),
+            protected_role_ids=frozenset(int(r) for r in config.protected()),
+            moderator_role_ids=frozenset(int(r) for r in config.moderator()),
+            administrator_user_ids=frozenset(int(u) for u in config.administrator()),
+            timeout_role_id=int(timeout_role) if timeout_role else None,
+            unmute_rate=config.unmute_rate(),
+            unmute_batch_size=config.unmute_batch_size(),
+            unmute_concurrency=config.unmute_concurrency(),
+            slow_trace_seconds=config.slow_trace_seconds(),
+            matcher=TriggerMatcher(config.roll_match_patterns()),
+            intervals=intervals,
+            affected_messages_self=compile_templates(config.roll_timeout_affected_messages_self(),
+                                                    "roulette_roll_timeout_affected_messages_self"),
+            affected_messages_other=compile_templates(config.roll_timeout_affected_messages_other(),
+                                                     "roulette_roll_timeout_affected_messages_other"),
+            protected_messages_self=compile_templates(config.roll_timeout_protected_messages_self(),
+                                                     "roulette_roll_timeout_protected_messages_self"),
+            protected_messages_other=compile_templates(config.roll_timeout_protected_messages_other(),
+                                                      "roulette_roll_timeout_protected_messages_other"),
+            response_delay_seconds=config.roll_timeout_response_delay_seconds(),
+            roll_concurrency=config.roll_timeout_concurrency(),
+            aggregate_replies=config.roll_timeout_aggregate_replies(),
+            debounce_backend=config.roll_debounce_backend(),
+            debounce_seconds=config.roll_debounce_seconds(),
+            debounce_role_seconds=MappingProxyType(
+                {int(role): seconds for role, seconds in config.roll_debounce_role_seconds().items()}),
+            leaderboard_webhook_urls=config.roll_timeout_leaderboard_webhook_urls(),
+            leaderboard_batch_size=config.roll_timeout_leaderboard_batch_size(),
+            leaderboard_max_attempts=config.roll_timeout_leaderboard_max_attempts(),
+            leaderboard_outbox_size=config.roll_timeout_leaderboard_outbox_size()
+        )
+
+
+_current: Optional[RouletteSettings] = None
+# Snapshots for every configured guild, keyed by guild ID.
+_guilds: Dict[int, RouletteSettings] = dict()
+_listeners: List[Callable[[RouletteSettings], None]] = list()
+
+
+def current(guild_id: Optional[int] = None) -> RouletteSettings:
+    """
+    The snapshots are built on first use if the extension hasn't loaded them yet.
+    :param guild_id: The guild to get the settings for.
+    :return: The active settings snapshot for a guild, or the primary guild's snapshot if the guild isn't configured
+        (or none is given).
+    """
+    primary = _current or load()
+    return _guilds.get(guild_id, primary) if guild_id is not None else primary
+
+
+def for_guild(guild_id: int) -> Optional[RouletteSettings]:
+    """
+    :return: The active settings snapshot for a guild, or None if the bot isn't configured to operate on it.
+    """
+    if _current is None:
+        load()
+    return _guilds.get(guild_id)
+
+
+def guilds() -> Tuple[RouletteSettings, ...]:
+    """
+    :return: The active settings snapshots for every configured guild, starting with the primary guild.
+    """
+    if _current is None:
+        load()
+    return tuple(_guilds.values())
+
+
+def load() -> RouletteSettings:
+    """
+    Builds a snapshot for every configured guild from the currently loaded settings, and makes them the active ones.
+    :return: The new snapshot for the primary guild.
+    """
+    global _current, _guilds
+    snapshots = dict()
+    for guild_id in config.guilds():
+        overrides = config.guild_overrides(guild_id)
+        overrides["roulette_guild"] = guild_id
+        with root_config.guild_overrides(overrides):
+            snapshot = RouletteSettings.build()
+        snapshots[snapshot.guild_id] = snapshot
+
+    _guilds = snapshots
+    _current = next(iter(snapshots.values()))
+    logger.info("Loaded settings snapshots for %s guild(s), with %s patterns and %s intervals",
+                len(_guilds), len(_current.matcher.patterns), len(_current.intervals))
+    for listener in _listeners:
+        listener(_current)
+    return _current
+
+
+def reload() -> bool:
+    """
+    Re-reads the settings files and atomically swaps in a new snapshot.
+    If the new settings are invalid, the previous settings and snapshot both stay active, so readers of the settings
+    (not just of the snapshot) never see the rejected values.
+    :return: Whether the new settings were applied.
+    """
+    try:
+        with root_config.reloaded():
+            load()
+    except Exception as e:
+        logger.error("Unable to reload settings, keeping the previous settings: %s", e)
+        return False
+    return True
+
+
+def subscribe(listener: Callable[[RouletteSettings], None]) -> None:
+    """
+    Registers a callback that is invoked with every new snapshot, e.g. to invalidate caches derived from the settings.
+    :param listener: A function that accepts the new snapshot.
+    """
+    _listeners.append(listener)
+
+
+def parse_duration(duration: str) -> int:
+    """
+    Parses a duration string (e.g. "5m", "2h", "1d", "1w") into minutes.
+    :param duration: The duration string, with one of the suffixes m, h, d or w.
+    :return: The duration, in minutes.
+    """
+    value = str(duration).strip()
+    number = value[:-1].strip()
+    if not value or value[-1] not in _SUFFIX_MINUTES or not number.isdigit():
+        raise ValueError(f"Invalid duration {duration!r}. Expected a number followed by one of: m, h, d, w")
+    return int(number) * _SUFFIX_MINUTES[value[-1]]
+
+
+def _parse_interval(interval: Dict) -> Interval:
+    lower = parse_duration(interval["bound"]["lower"])
+    upper = parse_duration(interval["bound"]["upper"])
+    weight = int(interval["weight"])
+    if lower > upper:
+        raise ValueError(f"Interval lower bound {lower}m is greater than its upper bound {upper}m")
+    if weight < 0:
+        raise ValueError(f"Interval weight {weight} can't be negative")
+    return Interval(lower, upper, weight)
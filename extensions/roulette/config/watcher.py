@@ -0,0 +1,51 @@
+import logging
+import os
+
+import config as root_config
+from discord.ext import tasks
+from discord.ext.commands import Bot, Cog
+from typing import Dict
+
+from . import config, settings
+
+
+class SettingsWatcher(Cog):
+    """
+    Polls the settings files for changes and hot-reloads the Roulette settings snapshot when they're modified.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.logger = logging.getLogger("roulette.settings")
+        self._mtimes = self._read_mtimes()
+        self.watch_loop.change_interval(seconds=config.settings_reload_seconds())
+        self.watch_loop.start()
+        self.logger.info("Loaded SettingsWatcher cog")
+
+    async def cog_unload(self) -> None:
+        self.watch_loop.cancel()
+
+    @tasks.loop(seconds=30)
+    async def watch_loop(self):
+        mtimes = self._read_mtimes()
+        if mtimes == self._mtimes:
+            return
+
+        self._mtimes = mtimes
+        self.logger.info("Settings files changed on disk, reloading settings")
+        if settings.reload():
+            self.logger.info("Reloaded settings")
+
+    @staticmethod
+    def _read_mtimes() -> Dict[str, float]:
+        """
+        :return: A mapping of each settings file found on disk to its last modification time.
+        """
+        mtimes = dict()
+        for path in root_config.settings_files():
+            try:
+                mtimes[path] = os.stat(path).st_mtime
+            except OSError:
+                # The file was removed between finding it and reading it. Treat it as missing.
+                continue
+        return mtimes
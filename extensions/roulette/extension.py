@@ -1,11 +1,24 @@
 import logging
 
+from api_extensions import http
+from database.redis_client import close_redis, init_redis
 from discord.ext.commands import Bot
+from redis.exceptions import RedisError
+from telemetry.exporter import start_exporter, stop_exporter
+from telemetry.metrics import REGISTRY
+from telemetry.watchdog import start_watchdog, stop_watchdog
+from typing import Optional
+from . import keys, metrics, timeouts
+from .config import config, settings
+from .config.watcher import SettingsWatcher
 from .roll.cog import Roll
+from .startup import Startup
 from .unmute.cog import Unmute
 
 logger = logging.getLogger("roulette")
 
+_startup: Optional[Startup] = None
+
 
 async def setup(bot: Bot) -> None:
     """
@@ -13,12 +26,63 @@ async def setup(bot: Bot) -> None:
 
     :param bot: The Discord bot the application is acting as
     """
+    global _startup
+    _startup = Startup()
+
+    # Build the settings snapshots up-front (compiling the match patterns and parsing the roll intervals), so invalid
+    # settings fail here rather than on the first roll.
+    with _startup.phase("settings"):
+        settings.load()
+
+    # A single pooled Redis client is shared by all cogs.
+    with _startup.phase("redis"):
+        client = init_redis()
+        logger.info("Using Redis keys prefixed with %r", keys.prefix())
+        try:
+            await client.ping()
+            # Move pending unmutes recorded before the keys were namespaced, before the Unmute cog reads them.
+            for guild_settings in settings.guilds():
+                await timeouts.migrate_legacy(guild_settings.guild_id)
+        except RedisError as e:
+            logger.critical("Unable to reach Redis: %s", e)
+
+    with _startup.phase("cogs"):
+        if config.settings_reload_seconds():
+            await bot.add_cog(SettingsWatcher(bot))
+            logger.info("Watching settings files for changes")
+
+        # TODO: Re-enable Redis-based mutes.
+        logger.info("Loading Unmute extension")
+        await bot.add_cog(Unmute(bot))
+        logger.info("Loaded Unmute extension")
+
+        logger.info("Loading Roll extension")
+        await bot.add_cog(Roll(bot))
+        logger.info("Loaded Roll extension")
 
-    # TODO: Re-enable Redis-based mutes.
-    logger.info("Loading Unmute extension")
-    await bot.add_cog(Unmute(bot))
-    logger.info("Loaded Unmute extension")
+    with _startup.phase("metrics"):
+        http.instrument(bot)
+        REGISTRY.add_collector(metrics.collect)
+        start_watchdog()
+        try:
+            await start_exporter()
+        except OSError as e:
+            logger.error("Unable to serve metrics: %s", e)
 
-    logger.info("Loading Roll extension")
-    await bot.add_cog(Roll(bot))
-    logger.info("Loaded Roll extension")
+    # Resolve and validate the configured guilds, roles and channels once the bot is ready.
+    _startup.start(bot)
+
+
+async def teardown(bot: Bot) -> None:
+    """
+    Called by Discord.py when this extension is unloaded.
+
+    :param bot: The Discord bot the application is acting as
+    """
+    if _startup:
+        _startup.cancel()
+    REGISTRY.remove_collector(metrics.collect)
+    stop_watchdog()
+    await stop_exporter()
+    await close_redis()
+    logger.info("Closed Redis connections")
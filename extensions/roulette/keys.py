@@ -0,0 +1,86 @@
+"""
+Redis keys used by the Roulette extension.
+
+Data that belongs to a guild is kept under that guild's own namespace, "<redis_key_const>:v<SCHEMA_VERSION>:<guild ID>",
+so several guilds (and several deployments, with different prefixes) can share one Redis server. SCHEMA_VERSION is
+bumped whenever the layout of the keys changes, so old and new layouts never collide.
+
+The prefix is read once, and isn't hot-reloaded: switching prefixes while running would strand every pending timeout
+under the old prefix, so changing it requires a restart.
+"""
+import config
+import logging
+
+from .config import settings
+from typing import Optional
+
+# The version of the key layout. Version 0 kept each guild's timeouts in a sorted set named after the guild ID.
+SCHEMA_VERSION = 1
+
+_DEFAULT_PREFIX = "roulette"
+
+logger = logging.getLogger("roulette")
+
+_prefix: Optional[str] = None
+
+
+def prefix() -> str:
+    """
+    :return: The prefix of every key, as configured when it was first read (see redis_key_const).
+    """
+    global _prefix
+    if _prefix is None:
+        _prefix = config.redis_key_const() or _DEFAULT_PREFIX
+    return _prefix
+
+
+def _namespace(guild_id: int) -> str:
+    return f"{prefix()}:v{SCHEMA_VERSION}:{guild_id}"
+
+
+def timeouts(guild_id: int) -> str:
+    """
+    :return: The sorted set of a guild's pending unmutes (member ID, scored by unmute time).
+    """
+    return f"{_namespace(guild_id)}:timeouts"
+
+
+def timeout(guild_id: int, member_id: int) -> str:
+    """
+    :return: The hash describing a member's current timeout in a guild (see timeouts.TimeoutRecord).
+    """
+    return f"{_namespace(guild_id)}:timeout:{member_id}"
+
+
+def legacy_timeouts(guild_id: int) -> str:
+    """
+    :return: The sorted set that held a guild's pending unmutes before the keys were namespaced (schema version 0).
+    """
+    return str(guild_id)
+
+
+def debounce(guild_id: int, user_id: int) -> str:
+    """
+    :return: The key marking a user's roll cooldown in a guild.
+    """
+    return f"{_namespace(guild_id)}:debounce:{user_id}"
+
+
+def stats_outbox() -> str:
+    """
+    :return: The stream of leaderboard stats events waiting to be sent. It's shared by every guild of the deployment.
+    """
+    return f"{prefix()}:v{SCHEMA_VERSION}:stats:outbox"
+
+
+def _warn_if_prefix_changed(*_) -> None:
+    """
+    Registered as a settings listener, since a new prefix only takes effect after a restart.
+    """
+    configured = config.redis_key_const() or _DEFAULT_PREFIX
+    if _prefix is not None and configured != _prefix:
+        logger.warning("redis_key_const changed from %r to %r. Restart the bot to use the new prefix.",
+                       _prefix, configured)
+
+
+settings.subscribe(_warn_if_prefix_changed)
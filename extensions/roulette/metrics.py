@@ -0,0 +1,80 @@
+"""
+Metrics exported by the Roulette extension (see telemetry.exporter).
+
+Counters and histograms are updated as messages and unmutes are handled. The unmute backlog and the stats outbox live
+in Redis, so they're only measured when the metrics are scraped, along with the counters other modules keep themselves.
+"""
+import time
+
+from . import keys
+from .config import settings
+from .roll import references, stats
+from api_extensions import resolver
+from database.redis_client import pipelined
+from telemetry.metrics import Counter, Gauge, Histogram
+
+# Outcomes of handling a message.
+IGNORED = "ignored"
+NON_MATCH = "non_match"
+DEBOUNCED = "debounced"
+ROLLED = "rolled"
+ERROR = "error"
+
+MESSAGES = Counter("roulette_messages_total",
+                   "Messages handled, by outcome (ignored, non_match, debounced, rolled or error).",
+                   labels=("outcome",))
+
+# Rolls include the artificial response delay, so their buckets go up to a minute.
+ROLL_LATENCY = Histogram("roulette_roll_duration_seconds",
+                         "Time from receiving a matching message to every target being handled.",
+                         buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+
+UNMUTE_TICK = Histogram("roulette_unmute_tick_duration_seconds",
+                        "Time taken to unmute every member that is due on a shard.",
+                        labels=("shard",))
+
+UNMUTE_BACKLOG = Gauge("roulette_unmute_due",
+                       "Members whose timeout has expired, but haven't been unmuted yet.",
+                       labels=("guild",))
+
+UNMUTE_OLDEST_AGE = Gauge("roulette_unmute_oldest_due_age_seconds",
+                          "How long ago the oldest due unmute should have been applied, or 0 if none are due.",
+                          labels=("guild",))
+
+REPLY_AUTHORS = Counter("roulette_reply_authors_total",
+                        "Reply-mention authors resolved, by tier (resolved, cached, recent, fetched, member_fetched or "
+                        "unresolved).",
+                        labels=("tier",))
+
+LOOKUPS = Counter("roulette_discord_lookups_total",
+                  "Discord object lookups by resolver and outcome (hits, negative_hits, misses, fetches or merged).",
+                  labels=("resolver", "outcome"))
+
+STATS_OUTBOX = Gauge("roulette_stats_outbox_depth",
+                     "Stats events in the outbox that haven't been sent to the leaderboard webhooks yet.")
+
+
+async def collect() -> None:
+    """
+    Measures the unmute backlog of every configured guild (in a single round trip), and the stats outbox depth.
+    """
+    for tier, count in references.counters().items():
+        REPLY_AUTHORS.set(count, tier=tier)
+    for name, counts in resolver.counters().items():
+        for outcome, count in counts.items():
+            LOOKUPS.set(count, resolver=name, outcome=outcome)
+
+    now = time.time()
+    guild_ids = [guild_settings.guild_id for guild_settings in settings.guilds()]
+    commands = list()
+    for guild_id in guild_ids:
+        commands.append(("ZCOUNT", keys.timeouts(guild_id), "-inf", now))
+        commands.append(("ZRANGE", keys.timeouts(guild_id), 0, 0, "WITHSCORES"))
+
+    results = await pipelined(*commands)
+    for index, guild_id in enumerate(guild_ids):
+        due, oldest = results[index * 2], results[index * 2 + 1]
+        UNMUTE_BACKLOG.set(due, guild=guild_id)
+        # Raw ZRANGE ... WITHSCORES replies are flat: [member, score]. The oldest entry is only overdue once it's due.
+        UNMUTE_OLDEST_AGE.set(max(0.0, now - float(oldest[1])) if oldest else 0, guild=guild_id)
+    STATS_OUTBOX.set(await stats.queue_depth())
@@ -0,0 +1,54 @@
+"""
+Classifies members into permission tiers.
+
+A member's tier is computed straight from the raw array of role IDs discord.py keeps for them (see members.role_ids),
+checked against the snapshot's role ID sets, so no Role objects are built or sorted. This works the same whether or not
+the member is in discord.py's member cache, which (with either gateway profile) most members aren't.
+"""
+from ..config import settings
+from api_extensions import members
+from discord import Member, User
+from enum import IntEnum
+
+
+class Tier(IntEnum):
+    """
+    Permission tiers, in increasing order. Each tier has the permissions of every tier below it: administrators are
+    implicitly moderators, and moderators are implicitly protected.
+    """
+    MEMBER = 0
+    PROTECTED = 1
+    MODERATOR = 2
+    ADMINISTRATOR = 3
+
+
+def tier(user: User | Member) -> Tier:
+    """
+    :param user: The user to classify. Users outside a guild (e.g. in DMs) can only be administrators or members.
+    :return: The user's permission tier.
+    """
+    is_member = isinstance(user, Member)
+    roulette_settings = settings.current(user.guild.id if is_member else None)
+    if user.id in roulette_settings.administrator_user_ids:
+        return Tier.ADMINISTRATOR
+    if not is_member:
+        return Tier.MEMBER
+
+    role_ids = members.role_ids(user)
+    if not roulette_settings.moderator_role_ids.isdisjoint(role_ids):
+        return Tier.MODERATOR
+    if not roulette_settings.protected_role_ids.isdisjoint(role_ids):
+        return Tier.PROTECTED
+    return Tier.MEMBER
+
+
+def is_protected(user: User | Member) -> bool:
+    return tier(user) >= Tier.PROTECTED
+
+
+def is_moderator(user: User | Member) -> bool:
+    return tier(user) >= Tier.MODERATOR
+
+
+def is_admin(user: User | Member) -> bool:
+    return tier(user) >= Tier.ADMINISTRATOR
@@ -2,28 +2,48 @@ import logging
 
 from api_extensions import roles as roles_api
 from discord import Guild, Role
-from typing import Optional
+from typing import Dict, Optional
 
-from ..config import config
+from ..config import settings
 
 logger = logging.getLogger("roulette.roles")
 
+# Resolved timeout roles, keyed by guild ID. Cleared when the settings are reloaded.
+_timeout_roles: Dict[int, Role] = dict()
+
 
 async def get_timeout_role(guild: Guild) -> Optional[Role]:
     """
     :param guild: A Guild to fetch the role from.
     :return: Returns a Discord role associated with an ID, or None if it can't be found.
     """
-    timeout_role = config.timeout_role()
+    timeout_role = settings.current(guild.id).timeout_role_id
     if not timeout_role:
         return None
 
+    if role := _timeout_roles.get(guild.id):
+        return role
+
     try:
         role = await roles_api.get_role(timeout_role, guild)
     except RuntimeError as e:
-        logger.critical(f"Unable to load timeout role {timeout_role}")
+        logger.critical("Unable to load timeout role %s", timeout_role)
         logger.critical(e)
         return None
 
-    logger.debug(f"Loaded timeout role {role.id} ({role.name})")
+    if not role:
+        return None
+
+    logger.debug("Loaded timeout role %s (%s)", role.id, role.name)
+    _timeout_roles[guild.id] = role
     return role
+
+
+def forget_timeout_role(guild: Guild) -> None:
+    """
+    Discards the resolved timeout role for a guild, e.g. after the role is deleted.
+    """
+    _timeout_roles.pop(guild.id, None)
+
+
+settings.subscribe(lambda _: _timeout_roles.clear())
@@ -1,7 +1,9 @@
 import logging
 import random
 
-from ..config import config
+from ..config import settings
+from ..config.settings import Interval
+from typing import Dict, List, Optional, Sequence, Tuple
 
 _WEEKS_IN_MINUTES = 10080
 _DAYS_IN_MINUTES = 1440
@@ -13,6 +15,8 @@ _TIME_CONVERSION_INTERVALS = (
     ('hours', _HOURS_IN_MINUTES),
     ('minutes', _MINUTES_IN_MINUTES)
 )
+# Durations up to Discord's maximum timeout (28 days) have their labels precomputed.
+_MAX_LABELLED_MINUTES = 4 * _WEEKS_IN_MINUTES
 
 logger = logging.getLogger("roulette.roll")
 
@@ -27,58 +31,121 @@ class Timeout:
 
     @property
     def duration_label(self):
-        return _convert_minutes_to_display_str(self._duration)
+        return duration_label(self._duration)
 
 
-def fetch() -> Timeout | None:
+class IntervalSampler:
     """
-    Fetches an action (i.e. timeout) to apply to the user.
-    :return: One of the action types.
+    Draws timeout durations (in minutes) from a set of weighted intervals.
+
+    The intervals are compiled once into an alias table (Vose's alias method), so selecting an interval costs O(1) per
+    draw regardless of the number of intervals, and the bounds are already parsed into minutes.
+    """
+
+    def __init__(self, intervals: Sequence[Interval], rng: Optional[random.Random] = None):
+        """
+        :param intervals: The intervals to draw from. At least one interval must have a positive weight.
+        :param rng: The random number generator to use, e.g. a seeded one for simulations. Defaults to the global one.
+        """
+        total = sum(interval.weight for interval in intervals)
+        if total <= 0:
+            raise ValueError("At least one interval must have a positive weight")
+
+        self._intervals: Tuple[Interval, ...] = tuple(intervals)
+        self._random = (rng or random).random
+        self._lowers = tuple(interval.lower for interval in intervals)
+        self._spans = tuple(interval.upper - interval.lower + 1 for interval in intervals)
+
+        # Build the alias table. Each slot holds the probability of keeping its own interval, and the interval to use
+        # otherwise. Scaled probabilities below 1 are "small" and get topped up by a "large" interval.
+        count = len(intervals)
+        scaled = [interval.weight * count / total for interval in intervals]
+        probabilities = [1.0] * count
+        aliases = list(range(count))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            probabilities[less] = scaled[less]
+            aliases[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Anything left over is (up to floating point error) exactly 1, so it always keeps its own interval.
+
+        self._probabilities = tuple(probabilities)
+        self._aliases = tuple(aliases)
+
+    @property
+    def intervals(self) -> Tuple[Interval, ...]:
+        return self._intervals
+
+    def sample(self) -> int:
+        """
+        :return: A duration in minutes, from a weighted random interval and uniformly within that interval's bounds.
+        """
+        rand = self._random
+        slot = int(rand() * len(self._aliases))
+        index = slot if rand() < self._probabilities[slot] else self._aliases[slot]
+        return self._lowers[index] + int(rand() * self._spans[index])
+
+    def sample_many(self, n: int) -> List[int]:
+        """
+        Draws many durations at once, e.g. for moderator rolls targeting several users, or for simulations.
+        :param n: The number of durations to draw.
+        :return: A list of n durations, in minutes.
+        """
+        rand = self._random
+        count = len(self._aliases)
+        probabilities, aliases, lowers, spans = self._probabilities, self._aliases, self._lowers, self._spans
+
+        durations = list()
+        for _ in range(n):
+            slot = int(rand() * count)
+            index = slot if rand() < probabilities[slot] else aliases[slot]
+            durations.append(lowers[index] + int(rand() * spans[index]))
+        return durations
+
+
+# Samplers for each guild's roll intervals, keyed by guild ID (None for the primary guild).
+_samplers: Dict[Optional[int], IntervalSampler] = dict()
+
+
+def fetch_many(n: int, guild_id: Optional[int] = None) -> List[Timeout]:
+    """
+    Fetches several actions at once, e.g. one for each target of a roll.
+    :param n: The number of actions to fetch.
+    :param guild_id: The guild the roll is in.
+    :return: A list of n actions.
     """
     # Currently, Timeout is the only action that will be applied.
-    return _generate_timeout()
+    durations = sampler(guild_id).sample_many(n)
+    logger.debug("Selected mute durations (in minutes): %s", durations)
+    return [Timeout(duration) for duration in durations]
 
 
-# TODO: Move timeout logic into its own directory.
+def sampler(guild_id: Optional[int] = None) -> IntervalSampler:
+    """
+    :param guild_id: The guild to get the sampler for.
+    :return: A sampler for the guild's current roll intervals. The sampler is only rebuilt when the settings are reloaded.
+    """
+    intervals = settings.current(guild_id).intervals
+    cached = _samplers.get(guild_id)
+    if cached is None or cached.intervals is not intervals:
+        cached = _samplers[guild_id] = IntervalSampler(intervals)
+        logger.debug("Built interval sampler for %s intervals.", len(intervals))
+    return cached
+
+
+def duration_label(minutes: int) -> str:
+    """
+    :return: A display of a duration, e.g. "1 week and 2 days". Durations over 28 days aren't precomputed.
+    """
+    if 0 <= minutes <= _MAX_LABELLED_MINUTES:
+        return _DURATION_LABELS[minutes]
+    return _convert_minutes_to_display_str(minutes)
 
-def _generate_timeout() -> Timeout:
-    # Load the list of intervals used to determine mutes.
-    intervals = config.roll_timeout_intervals()
-    logger.debug("Loaded {count} intervals.".format(count=int(len(intervals))))
-
-    # First, select an interval to load
-    # Create the bounds tuples and their respective weights
-    bounds = [interval["bound"] for interval in intervals]
-    weights = [int(interval["weight"]) for interval in intervals]
-    interval = random.choices(bounds, weights=weights, k=1)[0]
-
-    # From the interval, randomly select a time.
-    # The interval is a Tuple[lower_bound: str, upper_bound: str]
-    lower_bound = _convert_interval_str_to_minutes(interval["lower"])
-    upper_bound = _convert_interval_str_to_minutes(interval["upper"])
-
-    mute_duration = random.randint(lower_bound, upper_bound)
-    logger.debug(
-        "Selected mute duration: ({mute_duration}) from lower bound: ({lower_bound}) and upper bound: ({upper_bound}).".format(
-            mute_duration=_convert_minutes_to_display_str(mute_duration),
-            lower_bound=_convert_minutes_to_display_str(lower_bound),
-            upper_bound=_convert_minutes_to_display_str(upper_bound)))
-
-    return Timeout(mute_duration)
-
-
-def _convert_interval_str_to_minutes(interval: str) -> int:
-    # Strip out non-numeric characters
-    time = int("".join(filter(str.isdigit, interval)))
-    if interval.endswith("m"):
-        return time * _MINUTES_IN_MINUTES  # Base case
-    elif interval.endswith("h"):
-        return time * _HOURS_IN_MINUTES
-    elif interval.endswith("d"):
-        return time * _DAYS_IN_MINUTES
-    elif interval.endswith("w"):
-        return time * _WEEKS_IN_MINUTES
 
+# TODO: Move timeout logic into its own directory.
 
 def _convert_minutes_to_display_str(minutes: int, granularity=2) -> str:
     if minutes == 0:
@@ -93,3 +160,6 @@ def _convert_minutes_to_display_str(minutes: int, granularity=2) -> str:
             result.append("{} {}".format(value, name))
     start, _, end = ', '.join(result[:granularity]).rpartition(',')
     return start + " and" + end if start else end
+
+
+_DURATION_LABELS: Tuple[str, ...] = tuple(_convert_minutes_to_display_str(m) for m in range(_MAX_LABELLED_MINUTES + 1))
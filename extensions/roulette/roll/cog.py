@@ -1,19 +1,24 @@
 import logging
 import random
+import time
 
-from . import action, debounce, stats
-from ..config import config
-from ..roles.roles import get_timeout_role
+from . import action, debounce, references, stats
+from .. import metrics, timeouts
+from ..config import settings
+from ..roles import permissions
+from ..roles.permissions import Tier
+from ..roles.roles import forget_timeout_role, get_timeout_role
 
 from api_extensions import members
-from asyncio import sleep
-from database.redis_client import get_redis
+from asyncio import Semaphore, gather, sleep
 from datetime import datetime, timedelta, timezone
-from discord import Forbidden, HTTPException, Member, Message, User
+from discord import Member, Message, Role
 from discord.ext.commands import Bot, Cog, guild_only
-from typing import Set
+from telemetry.tracing import span, trace, traced
+from typing import List, Optional, Set
 
-_redis_client = get_redis()
+# Discord's maximum message length.
+_MESSAGE_LENGTH_LIMIT = 2000
 
 
 class Roll(Cog):
@@ -22,87 +27,118 @@ class Roll(Cog):
         self.logger = logging.getLogger("roulette.roll")
         self.logger.info("Loaded Roll cog")
 
+    async def cog_load(self) -> None:
+        stats.start_dispatcher()
+
+    async def cog_unload(self) -> None:
+        await stats.stop_dispatcher()
+
     async def cog_command_error(self, ctx, error: Exception) -> None:
         self.logger.warning(error)
 
     @Cog.listener()
     @guild_only()
     async def on_message(self, message: Message):
+        started = time.perf_counter()
+        slow_seconds = settings.current(message.guild.id).slow_trace_seconds if message.guild else 0
+        try:
+            with trace(f"message {message.id}", slow_seconds):
+                outcome = await self._handle_message(message)
+        except Exception:
+            metrics.MESSAGES.inc(outcome=metrics.ERROR)
+            raise
+
+        metrics.MESSAGES.inc(outcome=outcome)
+        if outcome == metrics.ROLLED:
+            metrics.ROLL_LATENCY.observe(time.perf_counter() - started)
+
+    async def _handle_message(self, message: Message) -> str:
+        """
+        Rolls for a message, if it should trigger a roll.
+        :return: The outcome of handling the message (see metrics.py).
+        """
+        # Only act in the guilds this bot is configured for, using that guild's settings.
+        roulette_settings = settings.for_guild(message.guild.id) if message.guild else None
+        if not roulette_settings:
+            return metrics.IGNORED
+
+        if message.channel.id in roulette_settings.channel_ids:
+            # Remember every message in observed channels, so rolls replying to them don't need to fetch them.
+            references.observe(message)
+
         if message.author == self.bot.user:
-            self.logger.debug(f"Ignoring self message: {message.id}")
-            return
+            self.logger.debug("Ignoring self message: %s", message.id)
+            return metrics.IGNORED
 
         if message.author.bot:
-            self.logger.debug(f"Ignoring bot message: {message.id}")
-            return
-
-        # Get user's permission status.
-        is_administrator = self._is_admin(message.author)
-        # All administrators are implicitly moderators and are protected
-        is_moderator = self._is_moderator(message.author) or is_administrator
-
-        if str(message.channel.id) not in config.channels():
-            if not (is_administrator or is_moderator):
-                self.logger.debug(f"Ignoring message (channel not observed): {message.id}")
-                return
-
-        # Check message against all match patterns
-        is_match = False
-        for pattern in config.roll_match_patterns():
-            if pattern.search(message.content):
-                is_match = True
-                break
-        if not is_match:
-            self.logger.debug(f"Ignoring message (no match): {message.id}")
-            return
-
-        self.logger.info(
-            f"Processing message from user {message.author.name}: [{str(message.id)[-4:]}]: {message.content}...")
-
-        should_debounce = not is_moderator and not is_administrator and debounce.should_debounce(message.author.id)
+            self.logger.debug("Ignoring bot message: %s", message.id)
+            return metrics.IGNORED
+
+        # Get user's permission status. All administrators are implicitly moderators and are protected.
+        with span("permissions"):
+            author_tier = permissions.tier(message.author)
+        is_moderator = author_tier >= Tier.MODERATOR
+        self.logger.debug("User %s's permission tier: %s", message.author.name, author_tier.name)
+
+        if message.channel.id not in roulette_settings.channel_ids:
+            if not is_moderator:
+                self.logger.debug("Ignoring message (channel not observed): %s", message.id)
+                return metrics.IGNORED
+
+        # Check message against all match patterns (in a single pass)
+        with span("match"):
+            pattern = roulette_settings.matcher.search(message.content)
+        if not pattern:
+            self.logger.debug("Ignoring message (no match): %s", message.id)
+            return metrics.NON_MATCH
+        self.logger.debug("Message %s matched pattern: %s", message.id, pattern.pattern)
+
+        self.logger.info("Processing message from user %s: [%s]: %s...",
+                         message.author.name, str(message.id)[-4:], message.content)
+
+        with span("debounce"):
+            should_debounce = not is_moderator and await debounce.should_debounce(message.author)
         if should_debounce:
-            self.logger.info(f"Debouncing message ...{str(message.id)[-4:]} from {message.author.name}")
-            return
+            self.logger.info("Debouncing message ...%s from %s", str(message.id)[-4:], message.author.name)
+            return metrics.DEBOUNCED
 
         # At this point, an action will be taken. Send a typing notification indicator.
         async with message.channel.typing():
 
             # Determine the targets for this rollout command.
-            targets = await self._determine_targets(message)
-            self.logger.debug(f"Starting roll for users: {', '.join([member.name for member in targets])}")
-
-            for target in targets:
-                self.logger.info(f"Now processing roll for user: {target.name}")
-                effect = action.fetch()
-
-                if configured_delay := config.roll_timeout_response_delay_seconds():
-                    delay = random.randint(1, configured_delay)
-                    self.logger.debug(f"Artificially waiting {delay} seconds before continuing")
-                    await sleep(delay)
-
-                if isinstance(effect, action.Timeout):
-                    self.logger.info(f"Rolled timeout of length {effect.duration_label} for {target.name}")
-                    await self._timeout(timedelta(minutes=effect.duration), effect.duration_label, message, target)
-                else:
-                    self.logger.critical("Received an unsupported action type.")
-                    continue
-
-    def _is_protected(self, member: Member) -> bool:
-        protected = set(config.protected())
-        is_protected = not protected.isdisjoint(set([str(role.id) for role in member.roles]))
-        self.logger.debug(f"User {member.name}'s protected status: {is_protected}")
-        return is_protected
-
-    def _is_moderator(self, member: Member) -> bool:
-        moderators = set(config.moderator())
-        is_moderator = not moderators.isdisjoint(set([str(role.id) for role in member.roles]))
-        self.logger.debug(f"User {member.name}'s mod status: {is_moderator}")
-        return is_moderator
-
-    def _is_admin(self, user: User | Member) -> bool:
-        is_admin = str(user.id) in config.administrator()
-        self.logger.debug(f"User {user.name}'s admin status: {is_admin}")
-        return is_admin
+            with span("targets"):
+                targets = list(await self._determine_targets(message, is_moderator))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Starting roll for users: %s", ", ".join(member.name for member in targets))
+
+            # Roll every target at once, then handle the targets concurrently (up to roll_concurrency at a time).
+            effects = action.fetch_many(len(targets), message.guild.id)
+            semaphore = Semaphore(roulette_settings.roll_concurrency)
+            aggregate = roulette_settings.aggregate_replies and len(targets) > 1
+            results = await gather(*(self._roll(message, target, effect, semaphore, reply=not aggregate)
+                                     for target, effect in zip(targets, effects)),
+                                   return_exceptions=True)
+
+            replies = list()
+            for target, result in zip(targets, results):
+                if isinstance(result, Exception):
+                    self.logger.error("Roll for user %s failed: %r", target.name, result)
+                elif result:
+                    replies.append(result)
+
+            if aggregate and replies:
+                await self._reply_all(message, replies)
+
+        return metrics.ROLLED
+
+    @Cog.listener()
+    async def on_member_join(self, member: Member):
+        members.forget_missing_member(member.id, member.guild)
+
+    @Cog.listener()
+    async def on_guild_role_delete(self, role: Role):
+        if role.id == settings.current(role.guild.id).timeout_role_id:
+            forget_timeout_role(role.guild)
 
     async def _determine_mentions(self, message: Message) -> Set[Member]:
         """
@@ -116,8 +152,8 @@ class Roll(Cog):
         mentions = set([mention for mention in message.mentions if isinstance(mention, Member)])
         # If there are mentions already (usual case), then the API worked okay and return immediately.
         if mentions:
-            mentioned_users = [mention.name for mention in mentions]
-            self.logger.debug(f'Using mentions provided by the API: {", ".join(mentioned_users)}')
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Using mentions provided by the API: %s", ", ".join(m.name for m in mentions))
             return mentions
 
         # If the message outright doesn't have a reference, there is no reply mention.
@@ -126,37 +162,31 @@ class Roll(Cog):
             self.logger.debug("Message doesn't have any references, so returning empty collection of mentions.")
             return set()
 
-        # Fetch the responded-to message from Discord.
-        reference_message = await message.channel.get_partial_message(message.reference.message_id).fetch()
-        if reference_message:
-            self.logger.debug(f"Fetched reference message {reference_message.id} from the Discord API")
-        else:
-            self.logger.warning(
-                f"Unable to resolve reference message {reference_message.id} from the Discord API. Assuming no mentions...")
-            return set()
+        # Find the author of the responded-to message, avoiding the Discord API where possible.
+        try:
+            reference_message_author = await references.resolve_reply_author(message)
+        except RuntimeError as e:
+            self.logger.critical(e)
+            reference_message_author = None
 
-        reference_message_author = await members.get_member(reference_message.author.id, message.guild)
         if reference_message_author:
-            self.logger.debug(f"Fetched reference message author {reference_message_author.name}")
+            self.logger.debug("Resolved reference message author %s", reference_message_author.name)
         else:
-            self.logger.warning(
-                f"Unable to fetch reference message author from the Discord API. Assuming no mentions...")
+            self.logger.warning("Unable to resolve reference message author. Assuming no mentions...")
             return set()
 
         # Note: It's okay to return mentions of the bot itself.
         return {reference_message_author}
 
-    async def _determine_targets(self, message: Message) -> Set[Member]:
+    async def _determine_targets(self, message: Message, is_moderator: bool) -> Set[Member]:
         """
         Determines the actual targets of a given message.
         :param message: The message event to process
+        :param is_moderator: Whether the message author is a moderator (or administrator).
         :return: A list of Discord Members that the roll is targeting.
         """
-        is_moderator = self._is_moderator(message.author)
-        is_administrator = self._is_admin(message.author)
-
         # Check if user *can* even mention first, to reduce fetch calls to the API.
-        if not is_moderator and not is_administrator:
+        if not is_moderator:
             self.logger.debug("Message author cannot roll for others - returning author as target.")
             return {message.author}
 
@@ -170,104 +200,167 @@ class Roll(Cog):
         self.logger.debug("Didn't find any mentions, returning message author as target.")
         return {message.author}
 
+    async def _roll(self,
+                    message: Message,
+                    target: Member,
+                    effect: action.Timeout | None,
+                    semaphore: Semaphore,
+                    reply: bool) -> Optional[str]:
+        """
+        Applies a rolled action to one target.
+        :param semaphore: Bounds how many targets are timed out at the same time. The artificial delay is waited out
+            before acquiring it, so one target's delay never holds up another target.
+        :param reply: Whether to reply to the message with the result. Otherwise, the caller is expected to.
+        :return: The reply text for this target, if any.
+        """
+        self.logger.info("Now processing roll for user: %s", target.name)
+
+        if configured_delay := settings.current(message.guild.id).response_delay_seconds:
+            delay = random.randint(1, configured_delay)
+            self.logger.debug("Artificially waiting %s seconds before continuing", delay)
+            with span("delay"):
+                await sleep(delay)
+
+        if not isinstance(effect, action.Timeout):
+            self.logger.critical("Received an unsupported action type.")
+            return None
+
+        self.logger.info("Rolled timeout of length %s for %s", effect.duration_label, target.name)
+        with span("queue"):
+            await semaphore.acquire()
+        try:
+            return await self._timeout(timedelta(minutes=effect.duration),
+                                       effect.duration_label,
+                                       message,
+                                       target,
+                                       reply)
+        finally:
+            semaphore.release()
+
+    async def _reply_all(self, message: Message, replies: List[str]):
+        """
+        Replies to a message with the replies for several targets, combined into as few messages as possible.
+        """
+        chunk = ""
+        for reply in replies:
+            if chunk and len(chunk) + len(reply) + 1 > _MESSAGE_LENGTH_LIMIT:
+                await traced("reply", message.reply(chunk))
+                chunk = ""
+            chunk = f"{chunk}\n{reply}" if chunk else reply
+        if chunk:
+            await traced("reply", message.reply(chunk))
+        self.logger.info("Sent combined reply for %s targets", len(replies))
+
     async def _timeout(self,
                        duration: timedelta,
                        duration_label: str,
                        message: Message,
-                       target: Member):
-
+                       target: Member,
+                       reply: bool) -> str:
+        """
+        Times a target out (unless they're protected).
+        :param reply: Whether to reply to the message. The reply is sent alongside the timeout's bookkeeping.
+        :return: The text to reply to the message with.
+        """
         is_self = target == message.author
-        self.logger.debug(f"Message is targeting self: {is_self}")
+        self.logger.debug("Message is targeting self: %s", is_self)
+
+        roulette_settings = settings.current(target.guild.id)
 
         # If target is protected, respond with a safe message and return immediately.
-        if self._is_protected(target) or self._is_moderator(target) or self._is_admin(target):
+        with span("permissions"):
+            is_protected = permissions.is_protected(target)
+        if is_protected:
             if is_self:
                 self.logger.info("Responding with protected message for self")
-                reply = random.choice(config.roll_timeout_protected_messages_self())
-                await message.reply(reply.format(user_name=target.display_name,
-                                                 duration_label=duration_label))
+                template = random.choice(roulette_settings.protected_messages_self)
             else:
                 self.logger.info("Responding with protected message for targeted user")
-                reply = random.choice(config.roll_timeout_protected_messages_other())
-                await message.reply(reply.format(user_name=target.display_name,
-                                                 duration_label=duration_label))
-            return
+                template = random.choice(roulette_settings.protected_messages_other)
+            text = template.render(user_name=target.display_name, duration_label=duration_label)
+            if reply:
+                await traced("reply", message.reply(text))
+            return text
 
         if duration > timedelta(days=28):
-            self.logger.warning(f"Received a mute for {duration_label}. This duration is currently unsupported.")
-            await message.reply("Sorry, something went wrong. Please roll again!")
-            return
+            self.logger.warning("Received a mute for %s. This duration is currently unsupported.", duration_label)
+            text = "Sorry, something went wrong. Please roll again!"
+            if reply:
+                await traced("reply", message.reply(text))
+            return text
+
+        # Because Mutebot instances can be deployed across a variety of timezones, prefer to always use a timezone-aware
+        # datetime object in UTC. (Don't use datetime.utcnow()).
+        unmute_time = datetime.now(timezone.utc) + duration
 
+        # Apply the timeout and the timeout role concurrently.
         # TODO: Remove shadow logic.
         # During deployment testing, apply the role silently to users. We assume the role doesn't actually do
         # anything - we just want to verify with audit logs that this is actually working.
-        try:
-            if await self._apply_timeout_roles(target, duration_label):
-                await self._record_timeout_in_redis(duration, target)
-                self.logger.info(f"Applied timeout role to user {target.id} ({target.name})")
-        except RuntimeError as e:
-            self.logger.critical(e)
-            # TODO: Enable this logic after shadow testing.
-            # await message.reply("Sorry, something went wrong. Please contact an administrator!")
-            # return
-
-        await target.timeout(duration, reason=f"Timed out for {duration_label} via Roulette")
-        self.logger.info(f"Timed {target.name} out for {duration_label}")
+        with span("role"):
+            role = await get_timeout_role(target.guild)
+        if not role:
+            self.logger.critical("Timeout role doesn't seem to exist. Please check your config.")
+        with span("edit"):
+            role_applied = await members.timeout_with_role(target,
+                                                           unmute_time,
+                                                           role,
+                                                           reason=f"Timed out for {duration_label} via Roulette")
+        self.logger.info("Timed %s out for %s", target.name, duration_label)
 
         if is_self:
             self.logger.info("Responding with affected message for self")
-            reply = random.choice(config.roll_timeout_affected_messages_self())
-            await message.reply(reply.format(user_name=target.display_name,
-                                             duration_label=duration_label))
+            template = random.choice(roulette_settings.affected_messages_self)
         else:
             self.logger.info("Responding with affected message for targeted user")
-            reply = random.choice(config.roll_timeout_affected_messages_other())
-            await message.reply(reply.format(user_name=target.display_name,
-                                             duration_label=duration_label))
-
-        stats.timeout_record_stats(duration, message)
-
-    async def _apply_timeout_roles(self, target: Member, duration_label: str) -> bool:
+            template = random.choice(roulette_settings.affected_messages_other)
+        text = template.render(user_name=target.display_name, duration_label=duration_label)
+
+        # The timeout is in place, so the reply and the bookkeeping don't depend on each other.
+        pending = [traced("stats", stats.timeout_record_stats(duration, message))]
+        if reply:
+            pending.append(traced("reply", message.reply(text)))
+        if role_applied:
+            pending.append(traced("redis", self._record_timeout(unmute_time, duration, message, target)))
+        await gather(*pending)
+        return text
+
+    async def _record_timeout(self, unmute_time: datetime, duration: timedelta, message: Message, member: Member):
         """
-        Applies the specified timeout roll onto a user.
-        :return: Whether the role was applied.
+        Records a timeout whose role was applied, so the role is removed when the timeout ends.
         """
-        role = await get_timeout_role(target.guild)
-        if not role:
-            raise RuntimeError(f"Timeout role doesn't seem to exist. Please check your config.")
-
         try:
-            await target.add_roles(role,
-                                   reason=f"Applying role as part of Mutebot Timeout of duration {duration_label}")
-            self.logger.info(f"Applied timeout role to user {target.name}")
-        except Forbidden:
-            raise RuntimeError(f"Bot doesn't have sufficient permissions to apply role {role.id} ({role.name}).")
-        except HTTPException:
-            self.logger.critical(
-                f"Adding role {role.id} ({role.name}) failed for no apparent reason. Please investigate!")
-            return False
-        return True
+            await self._record_timeout_in_redis(unmute_time, duration, message, member)
+            self.logger.info("Applied timeout role to user %s (%s)", member.id, member.name)
+        except RuntimeError as e:
+            self.logger.critical(e)
+            # TODO: Enable this logic after shadow testing.
+            # await message.reply("Sorry, something went wrong. Please contact an administrator!")
 
-    async def _record_timeout_in_redis(self, duration: timedelta, member: Member):
+    async def _record_timeout_in_redis(self,
+                                       unmute_time: datetime,
+                                       duration: timedelta,
+                                       message: Message,
+                                       member: Member):
         """
         Record a timeout into Redis (for future processing).
-        :param duration: The duration of the timeout that will be applied.
+        :param unmute_time: The time the user will be *unmuted* at.
+        :param duration: The timeout's duration.
+        :param message: The message that rolled the timeout.
         :param member: The member to time out.
         """
-
-        # Calculate the time the user will be *unmuted* at.
-        # Because Mutebot instances can be deployed across a variety of timezones, prefer to always use a timezone-aware
-        # datetime object in UTC. (Don't use datetime.utcnow()).
-        unmute_time = datetime.now(timezone.utc) + duration
-
-        # Use Redis' ZADD to store users' mute types in a ranked fashion.
-        # The unmute time (in unixtime) represents the score.
-        # See: https://redis.io/docs/latest/commands/zadd/
-        resp = _redis_client.zadd(name=config.guild(), mapping={member.id: unmute_time.timestamp()}, ch=True)
+        # The unmute time is recorded alongside the timeout's details, in a single round trip (see timeouts.py).
+        resp = await timeouts.record(member.guild.id,
+                                     member.id,
+                                     unmute_time,
+                                     duration=int(duration.total_seconds() // 60),
+                                     roller_id=message.author.id,
+                                     message_id=message.id)
 
         if resp != 1:
-            return RuntimeError(f"Redis reported {resp} scores were updated for user {member.id} ({member.name})")
+            raise RuntimeError(f"Redis reported {resp} scores were updated for user {member.id} ({member.name})")
 
-        self.logger.info(
-            f"Recorded timeout for user {member.id} ({member.name}) expiring at {unmute_time.strftime('%c')}")
+        self.logger.info("Recorded timeout for user %s (%s) expiring at %s", member.id, member.name, unmute_time)
+        # Let the Unmute cog schedule this timeout's expiry.
+        self.bot.dispatch("roulette_timeout_recorded", member.guild.id, member.id, unmute_time)
         return True
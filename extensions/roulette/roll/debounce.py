@@ -1,29 +1,197 @@
+"""
+Per-user roll cooldowns.
+
+Cooldowns are tracked by a DebounceBackend. Two backends are provided:
+- LocalDebounce tracks cooldowns in this process only, against the monotonic clock.
+- RedisDebounce shares cooldowns between every bot process using the same Redis server. Each cooldown is claimed with
+  an atomic SET NX PX, so only one process can start it. Known cooldowns are also cached locally, so repeated spam from
+  the same user is rejected without a Redis round trip.
+
+The backend is chosen by roulette_roll_debounce_backend, and can be replaced with set_backend().
+"""
 import logging
+import time
 
-from cachetools import TTLCache
-from datetime import datetime, timedelta
+from .. import keys
+from ..config import settings
+from abc import ABC, abstractmethod
+from database.redis_client import get_redis
+from discord import Member, User
+from redis.exceptions import RedisError
+from typing import Dict, Optional, Tuple
 
-# Cache storing all users that should be temporarily debounced from sending more requests.
-_CACHE = TTLCache(maxsize=5000, ttl=timedelta(minutes=1), timer=datetime.now)
+# Claims the cooldown if it isn't already running, or returns the time left on the running cooldown. Wrapping SET NX PX
+# in a script avoids a second round trip (to PTTL) when another process already owns the cooldown.
+_CLAIM_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return -1
+end
+return redis.call('PTTL', KEYS[1])
+"""
 
 logger = logging.getLogger("roulette.roll")
 
 
-def should_debounce(user_id: int) -> bool:
+class DebounceBackend(ABC):
     """
-    Debounces incoming user events against a local TTL Cache.
-    :param user_id: Discord user ID (snowflake)
-    :return: True if the user should be debounced (i.e. do not process), False otherwise.
+    Tracks per-user roll cooldowns.
+    """
+
+    @abstractmethod
+    async def should_debounce(self, guild_id: int, user_id: int, cooldown: float) -> bool:
+        """
+        Checks whether a user is in a cooldown. If they aren't, a new cooldown is started for them.
+        :param guild_id: The guild the user is rolling in. Cooldowns in different guilds are independent.
+        :param user_id: Discord user ID (snowflake)
+        :param cooldown: The length of a new cooldown, in seconds.
+        :return: True if the user should be debounced (i.e. do not process), False otherwise.
+        """
+
+
+class LocalDebounce(DebounceBackend):
+    """
+    Tracks cooldowns in this process, against the monotonic clock (so wall clock changes can't end a cooldown early).
+    """
+
+    def __init__(self, maxsize: int = 5000):
+        self._maxsize = maxsize
+        # The monotonic time each (guild ID, user ID) cooldown ends, in insertion order.
+        self._expiries: Dict[Tuple[int, int], float] = dict()
+
+    def __len__(self) -> int:
+        return len(self._expiries)
+
+    def remaining(self, guild_id: int, user_id: int) -> float:
+        """
+        :return: The number of seconds left on a user's cooldown, or 0 if they aren't in one.
+        """
+        expiry = self._expiries.get((guild_id, user_id))
+        if expiry is None:
+            return 0
+        remaining = expiry - time.monotonic()
+        if remaining <= 0:
+            del self._expiries[(guild_id, user_id)]
+            return 0
+        return remaining
+
+    def remember(self, guild_id: int, user_id: int, cooldown: float) -> None:
+        """
+        Records a cooldown for a user, replacing any cooldown they already have.
+        :param cooldown: The number of seconds left on the cooldown.
+        """
+        key = (guild_id, user_id)
+        self._expiries.pop(key, None)
+        self._expiries[key] = time.monotonic() + cooldown
+        if len(self._expiries) > self._maxsize:
+            self._evict()
+
+    async def should_debounce(self, guild_id: int, user_id: int, cooldown: float) -> bool:
+        if self.remaining(guild_id, user_id):
+            return True
+        self.remember(guild_id, user_id, cooldown)
+        return False
+
+    def _evict(self) -> None:
+        # Drop expired cooldowns first. If that isn't enough, drop the oldest ones.
+        now = time.monotonic()
+        self._expiries = {key: expiry for key, expiry in self._expiries.items() if expiry > now}
+        while len(self._expiries) > self._maxsize:
+            del self._expiries[next(iter(self._expiries))]
+
+
+class RedisDebounce(DebounceBackend):
+    """
+    Tracks cooldowns in Redis, so they're shared by every bot process, with a local cache in front.
+    If Redis can't be reached, falls back to the local cache alone.
+    """
+
+    def __init__(self, maxsize: int = 5000):
+        self._local = LocalDebounce(maxsize)
+        self._claim = None
+
+    async def should_debounce(self, guild_id: int, user_id: int, cooldown: float) -> bool:
+        # Fast path: a cooldown this process already knows about.
+        if self._local.remaining(guild_id, user_id):
+            return True
+
+        try:
+            remaining = await self._claim_cooldown(guild_id, user_id, cooldown)
+        except RedisError as e:
+            logger.error("Unable to check debounce for %s in Redis, using the local cache instead: %s", user_id, e)
+            return await self._local.should_debounce(guild_id, user_id, cooldown)
+
+        if remaining is None:
+            self._local.remember(guild_id, user_id, cooldown)
+            return False
+        # Another process started the cooldown. Cache it, so the rest of it is answered locally.
+        self._local.remember(guild_id, user_id, remaining)
+        return True
+
+    async def _claim_cooldown(self, guild_id: int, user_id: int, cooldown: float) -> Optional[float]:
+        """
+        :return: None if a new cooldown was started, otherwise the seconds left on the user's existing cooldown.
+        """
+        if self._claim is None:
+            self._claim = get_redis().register_script(_CLAIM_SCRIPT)
+        remaining = await self._claim(keys=[keys.debounce(guild_id, user_id)],
+                                      args=[1, max(1, int(cooldown * 1000))])
+        if remaining < 0:
+            # -1: Claimed. (-2 means the key expired between the SET and the PTTL, which is also a finished cooldown.)
+            return None if remaining == -1 else 0
+        return remaining / 1000
+
+
+_backend: Optional[DebounceBackend] = None
+_backend_name: Optional[str] = None
+
+
+def set_backend(backend: DebounceBackend) -> None:
+    """
+    Replaces the debounce backend, instead of the one chosen by roulette_roll_debounce_backend.
     """
-    # Discard aged keys in the TTLCache
-    _CACHE.expire()
+    global _backend, _backend_name
+    _backend, _backend_name = backend, None
 
-    # If the user isn't in the cache, add them to it and indicate user should not be debounced.
-    if user_id not in _CACHE.keys():
-        now = datetime.now().strftime("%c")
-        logger.debug(f"Adding {user_id} to debounce cache at {now} for 1 minute")
-        _CACHE[user_id] = datetime.now()
+
+def backend() -> DebounceBackend:
+    """
+    :return: The current debounce backend. The backend is only rebuilt when its setting changes.
+    """
+    global _backend, _backend_name
+    name = settings.current().debounce_backend
+    if _backend is None or (_backend_name is not None and _backend_name != name):
+        _backend = RedisDebounce() if name == "redis" else LocalDebounce()
+        _backend_name = name
+        logger.debug("Using %s debounce backend", name)
+    return _backend
+
+
+def cooldown_for(member: Member | User) -> int:
+    """
+    :return: The roll cooldown for a user, in seconds. If the user has several roles with their own cooldown, the
+        shortest applies.
+    """
+    is_member = isinstance(member, Member)
+    roulette_settings = settings.current(member.guild.id if is_member else None)
+    role_seconds = roulette_settings.debounce_role_seconds
+    if role_seconds and is_member:
+        overrides = [role_seconds[role.id] for role in member.roles if role.id in role_seconds]
+        if overrides:
+            return min(overrides)
+    return roulette_settings.debounce_seconds
+
+
+async def should_debounce(member: Member | User) -> bool:
+    """
+    Debounces incoming user events against the user's roll cooldown.
+    :param member: The user sending the event.
+    :return: True if the user should be debounced (i.e. do not process), False otherwise.
+    """
+    cooldown = cooldown_for(member)
+    if cooldown <= 0:
         return False
 
-    logger.debug(f"{user_id} not in debounce cache")
-    return True
+    guild_id = member.guild.id if isinstance(member, Member) else 0
+    debounced = await backend().should_debounce(guild_id, member.id, cooldown)
+    logger.debug("%s debounce status (cooldown %ss): %s", member.id, cooldown, debounced)
+    return debounced
@@ -0,0 +1,184 @@
+"""
+A single-pass matcher for the roll trigger patterns.
+
+Most messages in observed channels don't match any trigger, so rejecting a message should be as cheap as possible:
+- Messages shorter than the shortest possible match are rejected without looking at their content.
+- Each pattern with a required literal (e.g. "roll" in "^roll$") is gated on that literal. A plain substring check is
+  much cheaper than a regex search, and the pattern itself is only searched if its literal appears in the message.
+- All remaining patterns are merged into one alternation (each in its own named group, so the pattern that hit can
+  still be reported), so they cost one regex scan instead of one scan per pattern.
+
+Run benchmarks/matcher.py to compare this against searching each pattern in turn.
+"""
+import logging
+import re
+
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    # The regex parser is private, and only used to derive the prefilter. If it's unavailable, skip the prefilter.
+    from re import _constants as _sre_constants, _parser as _sre_parser
+except ImportError:  # pragma: no cover
+    _sre_constants = _sre_parser = None
+
+_REPEATS = (_sre_constants.MAX_REPEAT, _sre_constants.MIN_REPEAT, _sre_constants.POSSESSIVE_REPEAT) \
+    if _sre_constants else ()
+
+# Patterns that use (numbered or named) backreferences or conditionals can't be renumbered into a combined pattern.
+_UNMERGEABLE = re.compile(r"\\(?:[1-9]|g<)|\(\?P=|\(\?\(")
+# Global inline flags, e.g. (?i), are only allowed at the start of a pattern. They're rewritten as scoped flags.
+_LEADING_FLAGS = re.compile(r"^\(\?[aiLmsux]+\)")
+_SCOPED_FLAGS = (
+    (re.ASCII, "a"),
+    (re.IGNORECASE, "i"),
+    (re.MULTILINE, "m"),
+    (re.DOTALL, "s"),
+    (re.VERBOSE, "x")
+)
+# Under IGNORECASE, these ASCII letters also match non-ASCII characters (e.g. the Kelvin sign or a dotless i).
+# Literals containing them can't be checked with a plain str.lower() substring test.
+_IGNORECASE_UNSAFE = frozenset("iks")
+
+logger = logging.getLogger("roulette.roll")
+
+
+class _Gate(NamedTuple):
+    literal: str
+    ignore_case: bool
+    pattern: re.Pattern[str]
+
+
+class TriggerMatcher:
+    """
+    Matches messages against a collection of trigger patterns.
+    """
+
+    def __init__(self, patterns: Iterable[re.Pattern[str]]):
+        self._patterns: Tuple[re.Pattern[str], ...] = tuple(patterns)
+        widths = list()
+        gates = list()
+        ungated = list()
+
+        for index, pattern in enumerate(self._patterns):
+            parsed = _parse(pattern)
+            # An unparseable pattern has no known minimum width, so the length check can't reject anything.
+            widths.append(parsed.getwidth()[0] if parsed else 0)
+
+            ignore_case = bool(pattern.flags & re.IGNORECASE)
+            if parsed and (literal := _required_literal(parsed, ignore_case)):
+                gates.append(_Gate(literal, ignore_case, pattern))
+            else:
+                ungated.append(index)
+
+        self._min_length = min(widths, default=0)
+        self._gates: Tuple[_Gate, ...] = tuple(gates)
+        self._lower_haystack = any(gate.ignore_case for gate in self._gates)
+
+        mergeable = [i for i in ungated if _is_mergeable(self._patterns[i])]
+        self._combined: Optional[re.Pattern[str]] = _combine(self._patterns, mergeable)
+        merged = set(mergeable) if self._combined else set()
+        # Patterns that couldn't be merged are still searched one at a time, after the combined pattern.
+        self._fallback: Tuple[re.Pattern[str], ...] = tuple(self._patterns[i] for i in ungated if i not in merged)
+
+        logger.debug("Built trigger matcher: %s literal-gated pattern(s), %s merged pattern(s), "
+                     "%s fallback pattern(s), minimum length %s",
+                     len(self._gates), len(merged), len(self._fallback), self._min_length)
+
+    @property
+    def patterns(self) -> Tuple[re.Pattern[str], ...]:
+        return self._patterns
+
+    def search(self, content: str) -> Optional[re.Pattern[str]]:
+        """
+        :param content: The message content to check.
+        :return: The trigger pattern that matched the content, or None if no pattern matched.
+        """
+        if len(content) < self._min_length:
+            return None
+
+        lowered = content.lower() if self._lower_haystack else content
+        for gate in self._gates:
+            if gate.literal in (lowered if gate.ignore_case else content) and gate.pattern.search(content):
+                return gate.pattern
+
+        if self._combined:
+            match = self._combined.search(content)
+            if match:
+                return self._patterns[int(match.lastgroup[1:])]
+
+        for pattern in self._fallback:
+            if pattern.search(content):
+                return pattern
+        return None
+
+
+def _parse(pattern: re.Pattern[str]):
+    """
+    :return: The parsed pattern (from the regex parser), or None if it can't be parsed.
+    """
+    if _sre_parser is None:
+        return None
+    try:
+        return _sre_parser.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+
+def _is_mergeable(pattern: re.Pattern[str]) -> bool:
+    return not pattern.groupindex and not _UNMERGEABLE.search(pattern.pattern)
+
+
+def _combine(patterns: Tuple[re.Pattern[str], ...], indexes: List[int]) -> Optional[re.Pattern[str]]:
+    """
+    Combines the patterns at the given indexes into a single alternation.
+    Each pattern is wrapped in a named group (_<index>), with its flags scoped to that group.
+    :return: The combined pattern, or None if there's nothing to combine or the patterns can't be combined.
+    """
+    if not indexes:
+        return None
+
+    alternatives = list()
+    for index in indexes:
+        pattern = patterns[index]
+        flags = "".join(name for flag, name in _SCOPED_FLAGS if pattern.flags & flag)
+        body = _LEADING_FLAGS.sub("", pattern.pattern, count=1)
+        # In verbose mode, a trailing comment would otherwise swallow the closing parenthesis.
+        if pattern.flags & re.VERBOSE:
+            body += "\n"
+        alternatives.append(f"(?P<_{index}>(?{flags}:{body}))" if flags else f"(?P<_{index}>{body})")
+
+    try:
+        return re.compile("|".join(alternatives))
+    except re.error as e:
+        logger.warning("Unable to combine trigger patterns, matching them one at a time instead: %s", e)
+        return None
+
+
+def _required_literal(parsed, ignore_case: bool) -> Optional[str]:
+    """
+    :return: The longest run of literal characters at the top level of a parsed pattern (lowercased if ignore_case).
+        Every top-level item must match for the pattern to match, so this run must appear in any matching message.
+    """
+    longest, run = "", ""
+    for op, value in parsed:
+        char, repeated = None, False
+        if op is _sre_constants.LITERAL:
+            char = chr(value)
+        elif op in _REPEATS and value[0] >= 1 and len(value[2]) == 1 and value[2][0][0] is _sre_constants.LITERAL:
+            # A repeated literal (e.g. "a+") ends the current run, and its last repetition starts the next one.
+            char, repeated = chr(value[2][0][1]), True
+        if char is not None and ignore_case and (not char.isascii() or char.lower() in _IGNORECASE_UNSAFE):
+            char = None
+
+        if char is None:
+            run = ""
+            continue
+
+        char = char.lower() if ignore_case else char
+        run += char
+        if len(run) > len(longest):
+            longest = run
+        if repeated:
+            run = char
+
+    return longest or None
@@ -0,0 +1,115 @@
+"""
+Resolves the author of a replied-to message, for reply-mention rolls.
+
+The author is looked up in increasing order of cost, and the first tier that knows the author as a guild member wins:
+1. resolved: The referenced message Discord sent along with the reply.
+2. cached: discord.py's own message cache.
+3. recent: Authors of recently seen messages in the observed channels (see observe()).
+4. fetched: The message, fetched from the Discord API.
+A member taken from a message is only as current as the message, and may have gained or lost roles since. So the local
+tiers (1-3) only answer with a member if the replied-to message is at most _MEMBER_MAX_AGE old. Otherwise (or if they
+only know the author as a user), the member is looked up by ID, from the API if need be, and counted as member_fetched.
+How often each tier answers is reported by counters(), which are exported as metrics (see metrics.py).
+"""
+import logging
+
+from api_extensions import members
+from cachetools import LRUCache
+from datetime import timedelta
+from discord import DeletedReferencedMessage, HTTPException, Member, Message, NotFound, Object, User
+from discord.utils import snowflake_time, utcnow
+from typing import Dict, Optional
+
+# The number of recently seen messages whose authors are remembered.
+_RECENT_MESSAGES = 5000
+# How old a replied-to message can be for its author's roles to be trusted.
+_MEMBER_MAX_AGE = timedelta(minutes=5)
+
+logger = logging.getLogger("roulette.roll")
+
+# Authors of recently seen messages, keyed by message ID.
+_recent_authors: LRUCache[int, Member] = LRUCache(maxsize=_RECENT_MESSAGES)
+_counters: Dict[str, int] = dict.fromkeys(
+    ("resolved", "cached", "recent", "fetched", "member_fetched", "unresolved"), 0)
+
+
+def observe(message: Message) -> None:
+    """
+    Remembers who sent a message, in case it's replied to later.
+    """
+    if isinstance(message.author, Member):
+        _recent_authors[message.id] = message.author
+
+
+def counters() -> Dict[str, int]:
+    """
+    :return: How many reply authors each tier has resolved, how many needed their member looked up by ID (possibly from
+        the API), and how many couldn't be resolved.
+    """
+    return dict(_counters)
+
+
+async def resolve_reply_author(message: Message) -> Optional[Member]:
+    """
+    :param message: A message that may be a reply.
+    :return: The author of the replied-to message, or None if the message isn't a reply or its author can't be found.
+    """
+    reference = message.reference
+    if not reference or not reference.message_id:
+        return None
+
+    author = await _reply_author(message)
+    if author is None:
+        _counters["unresolved"] += 1
+        return None
+    if isinstance(author, Member):
+        # Prefer discord.py's own copy of the member (if it has one), which is kept up to date, over one from an older
+        # message.
+        return message.guild.get_member(author.id) or author
+    _counters["member_fetched"] += 1
+    return await members.get_member(author.id, message.guild)
+
+
+async def _reply_author(message: Message) -> Optional[User | Member | Object]:
+    """
+    :return: The author as a member, or as a user or bare ID (an Object) if no tier knows them as a current member.
+    """
+    reference = message.reference
+    if isinstance(reference.resolved, DeletedReferencedMessage):
+        logger.debug("Reference message %s was deleted", reference.message_id)
+        return None
+
+    fresh = utcnow() - snowflake_time(reference.message_id) <= _MEMBER_MAX_AGE
+    # The author from a tier that didn't know them as a current member, to look the member up by.
+    known: Optional[User | Object] = None
+    for tier, author in (("resolved", _author(reference.resolved)),
+                         ("cached", _author(reference.cached_message)),
+                         ("recent", _recent_authors.get(reference.message_id))):
+        if author is None:
+            continue
+        if fresh and isinstance(author, Member):
+            _counters[tier] += 1
+            return author
+        if known is None:
+            known = author if isinstance(author, User) else Object(id=author.id)
+
+    if known is not None:
+        return known
+
+    try:
+        fetched = await message.channel.get_partial_message(reference.message_id).fetch()
+    except NotFound:
+        logger.debug("Reference message %s doesn't exist", reference.message_id)
+        return None
+    except HTTPException as e:
+        logger.warning("Unable to fetch reference message %s from the Discord API: %s", reference.message_id, e)
+        return None
+
+    _counters["fetched"] += 1
+    logger.debug("Fetched reference message %s from the Discord API", fetched.id)
+    observe(fetched)
+    return fetched.author
+
+
+def _author(referenced: Optional[Message | DeletedReferencedMessage]) -> Optional[User | Member]:
+    return referenced.author if isinstance(referenced, Message) else None
@@ -1,20 +1,276 @@
+"""
+Sends timeout events to the leaderboard webhooks.
+
+When a timeout is rolled, its event is appended to a capped Redis Stream (the outbox) - a single O(1) write, with no
+HTTP on the roll's path. A background worker reads the outbox as part of a consumer group, sends the events to the
+webhooks, and only acknowledges (and deletes) them once every webhook has accepted them. Events therefore survive
+webhook outages and restarts, and are delivered at least once.
+
+The worker reuses a keep-alive HTTP session, sends to all webhooks concurrently, batches events together when
+roulette_roll_timeout_leaderboard_batch_size is greater than 1, and retries failures with backoff. Events that another
+worker read but never acknowledged (e.g. it was stopped, or its container was replaced) are claimed once they've been
+idle for long enough.
+"""
+import aiohttp
+import asyncio
+import json
 import logging
-import requests
+import os
+import random
+import socket
 
-from ..config import config
+from .. import keys
+from ..config import settings
+from database.redis_client import get_redis, pipelined
 from datetime import timedelta
 from discord import Message
+from redis.exceptions import RedisError, ResponseError
+from typing import Any, Dict, List, Optional, Tuple
+
+_GROUP = "leaderboard"
+_EVENT_FIELD = "event"
+# How long each read waits for new events, so the worker can notice cancellation.
+_READ_BLOCK_MILLISECONDS = 5000
+_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+_RETRY_BASE_SECONDS = 1
+_RETRY_MAX_SECONDS = 60
+# Events that have been pending for this long are assumed to belong to a worker that's gone, and are claimed. This is
+# well beyond the time a live worker spends retrying a batch.
+_CLAIM_IDLE_MILLISECONDS = 10 * 60 * 1000
+# Time between checks for events (and consumers) left behind by other workers.
+_CLAIM_INTERVAL_SECONDS = 60
+_CLAIM_COUNT = 100
 
 logger = logging.getLogger("roulette.roll")
 
 
-def timeout_record_stats(duration: timedelta, message: Message) -> None:
+class StatsDispatcher:
+    def __init__(self):
+        # Each worker is its own consumer, even alongside others on the same host. Events left pending by a previous
+        # worker (e.g. before a restart) are claimed by _claim_stale().
+        self._consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+        Opens the HTTP session and starts draining the outbox in the background.
+        """
+        if self._task:
+            return
+        self._session = aiohttp.ClientSession(timeout=_REQUEST_TIMEOUT)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops the background task and closes the HTTP session. Unsent events stay in the outbox.
+        """
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        group_created = False
+        next_claim = loop.time()
+        # Start with events that were delivered but never acknowledged, e.g. before a restart.
+        read_pending = True
+        failures = 0
+        while True:
+            try:
+                if not group_created:
+                    await self._create_group()
+                    group_created = True
+                if loop.time() >= next_claim:
+                    if await self._claim_stale():
+                        read_pending = True
+                    next_claim = loop.time() + _CLAIM_INTERVAL_SECONDS
+
+                # Read once per batch, so a reload between reading and sending can't change how the batch is sent.
+                batch_size = settings.current().leaderboard_batch_size
+                entries = await self._read("0" if read_pending else ">", batch_size)
+                if not entries:
+                    read_pending = False
+                    continue
+
+                if await self._send([event for _, event in entries], batched=batch_size > 1):
+                    await self._acknowledge([entry_id for entry_id, _ in entries])
+                    failures = 0
+                    continue
+            except RedisError as e:
+                logger.error("Unable to read stats events from the outbox: %s", e)
+            except Exception as e:
+                # Never let a single bad batch stop the dispatcher.
+                logger.error("Unable to send stats events: %s", e)
+
+            # Leave the events pending, and retry them after backing off.
+            read_pending = True
+            failures += 1
+            await asyncio.sleep(min(_RETRY_BASE_SECONDS * 2 ** failures, _RETRY_MAX_SECONDS))
+
+    async def _create_group(self):
+        try:
+            # Start from the beginning of the stream, so events written before the group existed are still sent.
+            await get_redis().xgroup_create(keys.stats_outbox(), _GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _claim_stale(self) -> int:
+        """
+        Claims events that other consumers read but haven't acknowledged for _CLAIM_IDLE_MILLISECONDS, and removes
+        consumers that have nothing pending and have been idle for as long.
+        :return: The number of events that were claimed. They're read as this consumer's pending events.
+        """
+        redis = get_redis()
+        claimed = 0
+        while True:
+            entry_ids = await redis.xautoclaim(keys.stats_outbox(),
+                                               _GROUP,
+                                               self._consumer,
+                                               _CLAIM_IDLE_MILLISECONDS,
+                                               count=_CLAIM_COUNT,
+                                               justid=True)
+            claimed += len(entry_ids)
+            if len(entry_ids) < _CLAIM_COUNT:
+                break
+        if claimed:
+            logger.warning("Claimed %s stats events left pending by other workers", claimed)
+
+        for consumer in await redis.xinfo_consumers(keys.stats_outbox(), _GROUP):
+            name = consumer["name"].decode("utf-8")
+            if name != self._consumer and not consumer["pending"] and consumer["idle"] >= _CLAIM_IDLE_MILLISECONDS:
+                await redis.xgroup_delconsumer(keys.stats_outbox(), _GROUP, name)
+                logger.info("Removed idle stats consumer %s", name)
+        return claimed
+
+    async def _read(self, stream_id: str, count: int) -> List[Tuple[bytes, Dict[str, Any]]]:
+        """
+        :param stream_id: "0" to read this consumer's pending (unacknowledged) events, or ">" to read new events.
+        :param count: The maximum number of events to read.
+        :return: Up to count (ID, event) tuples.
+        """
+        response = await get_redis().xreadgroup(_GROUP,
+                                                self._consumer,
+                                                {keys.stats_outbox(): stream_id},
+                                                count=count,
+                                                block=None if stream_id == "0" else _READ_BLOCK_MILLISECONDS)
+        if not response:
+            return list()
+
+        entries = list()
+        for entry_id, fields in response[0][1]:
+            if not fields:
+                # The entry was trimmed from the stream (due to the outbox size) after it was delivered.
+                await self._acknowledge([entry_id])
+                continue
+            entries.append((entry_id, json.loads(fields[_EVENT_FIELD.encode()])))
+        return entries
+
+    @staticmethod
+    async def _acknowledge(entry_ids: List[bytes]):
+        if entry_ids:
+            stream_key = keys.stats_outbox()
+            await pipelined(("XACK", stream_key, _GROUP, *entry_ids), ("XDEL", stream_key, *entry_ids))
+
+    async def _send(self, events: List[Dict[str, Any]], batched: bool) -> bool:
+        """
+        Sends each event to the webhooks of the guild it happened in. Events of guilds this deployment isn't configured
+        for (e.g. since removed from its settings) are dropped, rather than sent to another guild's webhooks.
+        :param batched: Whether each webhook receives its events as a single list, rather than one request per event.
+        :return: Whether every webhook accepted the events.
+        """
+        roulette_settings = settings.current()
+        by_urls: Dict[Tuple[str, ...], List[Dict[str, Any]]] = dict()
+        for event in events:
+            guild_id = int(event["discord"]["guild_id"])
+            guild_settings = settings.for_guild(guild_id)
+            if guild_settings is None:
+                logger.warning("Dropping stats event for unconfigured guild %s", guild_id)
+                continue
+            by_urls.setdefault(guild_settings.leaderboard_webhook_urls, list()).append(event)
+
+        results = await asyncio.gather(*(self._post(url, body, roulette_settings.leaderboard_max_attempts)
+                                         for urls, guild_events in by_urls.items()
+                                         for body in ([guild_events] if batched else guild_events)
+                                         for url in urls))
+        return all(results)
+
+    async def _post(self, url: str, body: Any, max_attempts: int) -> bool:
+        """
+        Sends a request body to a webhook, retrying connection errors, rate limits and server errors with exponential
+        backoff (and jitter).
+        :return: Whether the webhook accepted the request. Requests the webhook rejects outright are not retried, and
+            count as accepted.
+        """
+        for attempt in range(1, max_attempts + 1):
+            retry_after = None
+            try:
+                async with self._session.post(url, json=body) as response:
+                    if response.status < 400:
+                        logger.debug("Sent stats update to %s", url)
+                        return True
+                    if response.status != 429 and response.status < 500:
+                        logger.error("Leaderboard webhook %s rejected stats update with status %s",
+                                     url, response.status)
+                        return True
+                    error = f"status {response.status}"
+                    if response.status == 429 and (header := response.headers.get("Retry-After", "")).isdigit():
+                        retry_after = int(header)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+
+            if attempt == max_attempts:
+                logger.error("Unable to send stats update to %s after %s attempts (%s)", url, attempt, error)
+                return False
+
+            delay = retry_after or min(_RETRY_BASE_SECONDS * 2 ** (attempt - 1), _RETRY_MAX_SECONDS)
+            delay += random.uniform(0, delay / 2)
+            logger.warning("Stats update to %s failed (%s), retrying in %.1fs", url, error, delay)
+            await asyncio.sleep(delay)
+        return False
+
+
+_dispatcher = StatsDispatcher()
+
+
+def start_dispatcher() -> None:
+    """
+    Starts draining the outbox in the background. Must be called from within the event loop, after Redis is initialized.
+    """
+    _dispatcher.start()
+
+
+async def stop_dispatcher() -> None:
+    """
+    Stops draining the outbox.
     """
-    Records a timeout event for stats handling.
+    await _dispatcher.stop()
+
+
+async def queue_depth() -> int:
+    """
+    :return: The number of stats events in the outbox that haven't been sent yet.
+    """
+    # Events are deleted once they're acknowledged, so the stream only holds unsent events.
+    return await get_redis().xlen(keys.stats_outbox())
+
+
+async def timeout_record_stats(duration: timedelta, message: Message) -> None:
+    """
+    Records a timeout event for stats handling, by appending it to the outbox. The event is sent in the background.
     :param duration: A timedelta representing the total duration of the timeout
     :param message: The original message that triggered the timeout
     """
-    body = {
+    roulette_settings = settings.current(message.guild.id)
+    if not roulette_settings.leaderboard_webhook_urls:
+        return
+
+    # Note: The IDs must be passed as strings to avoid auto-rounding.
+    event = {
         "discord": {
             "user_id": str(message.author.id),
             "guild_id": str(message.guild.id)
@@ -23,8 +279,12 @@ def timeout_record_stats(duration: timedelta, message: Message) -> None:
             "duration": int(duration / timedelta(minutes=1))
         }
     }
-
-    for leaderboard_url in config.roll_timeout_leaderboard_webhook_urls():
-        # Note: The IDs must be passed as strings to avoid auto-rounding.
-        requests.post(leaderboard_url, json=body)
-        logger.debug(f"Sending stats update to {leaderboard_url}")
+    try:
+        await get_redis().xadd(keys.stats_outbox(),
+                               {_EVENT_FIELD: json.dumps(event)},
+                               # The outbox is shared by every guild, so its size comes from the primary guild.
+                               maxlen=settings.current().leaderboard_outbox_size,
+                               approximate=True)
+    except RedisError as e:
+        # Stats are best-effort, so this shouldn't fail the roll.
+        logger.error("Unable to record stats event in the outbox: %s", e)
@@ -0,0 +1,68 @@
+"""
+Precompiled reply templates.
+
+Reply messages are parsed once, when the settings are loaded, into literal text and placeholders. Unknown placeholders
+fail then (so a bad template fails at startup or on reload, rather than on a roll), and rendering a reply is a single
+join with no parsing.
+"""
+from string import Formatter
+from typing import Iterable, Optional, Tuple
+
+# Placeholders that replies can use, and the names they're also documented under.
+PLACEHOLDERS = frozenset(("user_name", "duration_label"))
+_ALIASES = {
+    "timeout_user_name": "user_name",
+    "timeout_duration_label": "duration_label"
+}
+
+
+class ReplyTemplate:
+    __slots__ = ("text", "_parts")
+
+    def __init__(self, text: str):
+        """
+        :param text: The template, e.g. "{user_name} was timed out for {duration_label}". Braces are escaped by
+            doubling them, as with str.format.
+        Raises a ValueError if the template is malformed or uses an unknown placeholder.
+        """
+        self.text = text
+        # Alternating literal text and placeholder names (None for literal text), with adjacent literals merged.
+        parts = list()
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if literal:
+                if parts and parts[-1][1] is None:
+                    parts[-1] = (parts[-1][0] + literal, None)
+                else:
+                    parts.append((literal, None))
+            if field is None:
+                continue
+            name = _ALIASES.get(field, field)
+            if name not in PLACEHOLDERS:
+                supported = ", ".join(f"{{{p}}}" for p in sorted(PLACEHOLDERS | _ALIASES.keys()))
+                raise ValueError(f"Unknown placeholder {{{field}}} in reply {text!r}. Supported: {supported}")
+            if spec or conversion:
+                raise ValueError(f"Placeholder {{{field}}} in reply {text!r} can't have a format or conversion")
+            parts.append(("", name))
+        self._parts: Tuple[Tuple[str, Optional[str]], ...] = tuple(parts)
+
+    def render(self, **values: str) -> str:
+        """
+        :param values: A value for each placeholder (see PLACEHOLDERS).
+        :return: The reply text.
+        """
+        return "".join(values[name] if name else literal for literal, name in self._parts)
+
+    def __repr__(self) -> str:
+        return f"ReplyTemplate({self.text!r})"
+
+
+def compile_templates(texts: Iterable[str], setting: str) -> Tuple[ReplyTemplate, ...]:
+    """
+    :param texts: The templates to compile.
+    :param setting: The setting the templates were read from, to report in errors.
+    :return: The compiled templates. Raises a ValueError naming the setting if any template is invalid.
+    """
+    try:
+        return tuple(ReplyTemplate(text) for text in texts)
+    except ValueError as e:
+        raise ValueError(f"{setting}: {e}") from None
@@ -0,0 +1,30 @@
+"""
+Helpers for working out which shard a guild belongs to, and which shards this process runs.
+"""
+from discord import AutoShardedClient, Client
+from typing import Tuple
+
+
+def shard_count(bot: Client) -> int:
+    """
+    :return: The total number of shards the bot is split into (across all processes).
+    """
+    return bot.shard_count or 1
+
+
+def shard_for(guild_id: int, count: int) -> int:
+    """
+    :param guild_id: The guild to find the shard for.
+    :param count: The total number of shards.
+    :return: The shard that receives the guild's events, using Discord's sharding formula.
+    """
+    return (guild_id >> 22) % count
+
+
+def local_shard_ids(bot: Client) -> Tuple[int, ...]:
+    """
+    :return: The shards this process runs. Only valid once the bot has connected.
+    """
+    if isinstance(bot, AutoShardedClient):
+        return tuple(sorted(bot.shards)) or tuple(range(shard_count(bot)))
+    return (bot.shard_id or 0,)
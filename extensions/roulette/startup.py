@@ -0,0 +1,115 @@
+"""
+The Roulette startup sequence.
+
+Everything a roll needs is resolved up-front, so the first roll doesn't pay for cold lookups: the settings are built
+(compiling the match patterns and parsing the roll intervals) when the extension is set up, then once the bot is ready,
+each configured guild, its timeout, protected and moderator roles, administrators and channels are resolved and
+validated. Problems are logged, rather than raised, so one misconfigured guild doesn't stop the others.
+
+Each phase is timed, and a breakdown is logged once startup finishes.
+"""
+import asyncio
+import logging
+import time
+
+from .config import settings
+from .config.settings import RouletteSettings
+from .roles.roles import get_timeout_role
+from .roll import action
+from api_extensions import guilds, members, roles
+from contextlib import contextmanager
+from discord import Guild
+from discord.ext.commands import Bot
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger("roulette.startup")
+
+
+class Startup:
+    def __init__(self):
+        self._started = time.perf_counter()
+        # Time spent in each phase, in seconds, in the order the phases ran.
+        self.timings: Dict[str, float] = dict()
+        self.problems: List[str] = list()
+        self._task: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Times a phase of the startup sequence.
+        Example: with startup.phase("redis"): init_redis()
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - started
+
+    def start(self, bot: Bot) -> None:
+        """
+        Finishes the startup sequence in the background, once the bot is ready.
+        """
+        self._task = asyncio.create_task(self._finish(bot))
+
+    def cancel(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _finish(self, bot: Bot):
+        with self.phase("gateway"):
+            await bot.wait_until_ready()
+
+        for guild_settings in settings.guilds():
+            await self._warm_guild(bot, guild_settings)
+
+        breakdown = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in self.timings.items())
+        total = time.perf_counter() - self._started
+        if self.problems:
+            logger.critical("Roulette started with %s problem(s): %s", len(self.problems), '; '.join(self.problems))
+        logger.info("Roulette ready in %.2fs (%s)", total, breakdown)
+
+    async def _warm_guild(self, bot: Bot, guild_settings: RouletteSettings):
+        guild_id = guild_settings.guild_id
+
+        with self.phase("guilds"):
+            try:
+                guild = await guilds.get_guild(guild_id, bot)
+            except RuntimeError as e:
+                logger.critical(e)
+                guild = None
+        if not guild:
+            self.problems.append(f"guild {guild_id} couldn't be loaded")
+            return
+
+        with self.phase("roles"):
+            if not await get_timeout_role(guild):
+                self.problems.append(f"timeout role {guild_settings.timeout_role_id} doesn't exist in guild {guild_id}")
+            for role_id in guild_settings.protected_role_ids | guild_settings.moderator_role_ids:
+                if not await _resolve(roles.get_role(role_id, guild)):
+                    self.problems.append(f"role {role_id} doesn't exist in guild {guild_id}")
+
+        with self.phase("administrators"):
+            for user_id in guild_settings.administrator_user_ids:
+                if not await _resolve(members.get_member(user_id, guild)):
+                    # Not a problem: administrators are configured per user, and may not be in every guild.
+                    logger.warning("Administrator %s isn't a member of guild %s", user_id, guild_id)
+
+        with self.phase("channels"):
+            self._check_channels(guild, guild_settings)
+
+        with self.phase("intervals"):
+            action.sampler(guild_id)
+
+    def _check_channels(self, guild: Guild, guild_settings: RouletteSettings):
+        for channel_id in guild_settings.channel_ids:
+            if not guild.get_channel(channel_id):
+                self.problems.append(f"channel {channel_id} doesn't exist in guild {guild.id}")
+
+
+async def _resolve(lookup):
+    try:
+        return await lookup
+    except RuntimeError as e:
+        logger.critical(e)
+        return None
@@ -0,0 +1,136 @@
+"""
+Timeouts recorded in Redis.
+
+Each guild's timeouts are kept in two kinds of keys (see keys.py):
+- keys.timeouts(guild_id): A sorted set of member IDs, scored by unmute time. The Unmute cog pages through the members
+  that are due.
+- keys.timeout(guild_id, member_id): A hash describing the member's current timeout (see TimeoutRecord), so questions
+  about one timeout (how long is left, who rolled it, which message it came from) are answered with a single read.
+
+Both are written and removed together in one MULTI/EXEC round trip, so neither is seen without the other. Hashes also
+expire a while after their unmute time, in case their member is removed from the sorted set some other way.
+"""
+import logging
+
+from . import keys
+from dataclasses import dataclass
+from database.redis_client import get_redis, pipelined
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+# Time in seconds after the unmute time that a timeout's hash expires, leaving plenty of time for unmute retries.
+_EXPIRE_AFTER_SECONDS = 7 * 24 * 60 * 60
+
+logger = logging.getLogger("roulette.timeouts")
+
+
+@dataclass(frozen=True)
+class TimeoutRecord:
+    member_id: int
+    unmute_at: datetime
+    # Timeouts migrated from the legacy layout only know their unmute time.
+    duration: Optional[int] = None
+    roller_id: Optional[int] = None
+    message_id: Optional[int] = None
+    applied_at: Optional[datetime] = None
+
+    @property
+    def remaining(self) -> timedelta:
+        """
+        :return: The time left until the member is unmuted, or 0 if the unmute is due.
+        """
+        return max(timedelta(0), self.unmute_at - datetime.now(timezone.utc))
+
+
+async def record(guild_id: int,
+                 member_id: int,
+                 unmute_time: datetime,
+                 duration: int,
+                 roller_id: int,
+                 message_id: int) -> int:
+    """
+    Records a timeout, replacing the member's current timeout if they have one.
+    :param unmute_time: The time the member will be unmuted at.
+    :param duration: The timeout's duration, in minutes.
+    :param roller_id: The user that rolled the timeout (the member themselves, or a moderator).
+    :param message_id: The message that rolled the timeout.
+    :return: The number of unmute times that were added or changed (see ZADD CH), i.e. 1 unless the member already had a
+        timeout ending at exactly the same time.
+    """
+    unmute_at = unmute_time.timestamp()
+    fields = {
+        "duration": duration,
+        "roller": roller_id,
+        "message": message_id,
+        "applied_at": datetime.now(timezone.utc).timestamp(),
+        "unmute_at": unmute_at
+    }
+    timeout_key = keys.timeout(guild_id, member_id)
+    changed, *_ = await pipelined(("ZADD", keys.timeouts(guild_id), "CH", unmute_at, member_id),
+                                  ("HSET", timeout_key, *(item for pair in fields.items() for item in pair)),
+                                  ("EXPIREAT", timeout_key, _expire_at(unmute_at)),
+                                  transaction=True)
+    return changed
+
+
+async def remove(guild_id: int, member_ids: Iterable[int]) -> int:
+    """
+    Removes members' timeouts, e.g. once they've been unmuted.
+    :return: The number of members that had a timeout.
+    """
+    member_ids = list(member_ids)
+    if not member_ids:
+        return 0
+    removed, _ = await pipelined(("ZREM", keys.timeouts(guild_id), *member_ids),
+                                 ("DEL", *(keys.timeout(guild_id, member_id) for member_id in member_ids)),
+                                 transaction=True)
+    return removed
+
+
+async def fetch(guild_id: int, member_id: int) -> Optional[TimeoutRecord]:
+    """
+    :return: A member's current timeout, or None if they aren't timed out.
+    """
+    fields: Dict[bytes, bytes] = await get_redis().hgetall(keys.timeout(guild_id, member_id))
+    if b"unmute_at" not in fields:
+        return None
+
+    def optional_int(name: bytes) -> Optional[int]:
+        return int(fields[name]) if name in fields else None
+
+    applied_at = fields.get(b"applied_at")
+    return TimeoutRecord(member_id=member_id,
+                         unmute_at=datetime.fromtimestamp(float(fields[b"unmute_at"]), timezone.utc),
+                         duration=optional_int(b"duration"),
+                         roller_id=optional_int(b"roller"),
+                         message_id=optional_int(b"message"),
+                         applied_at=datetime.fromtimestamp(float(applied_at), timezone.utc) if applied_at else None)
+
+
+async def migrate_legacy(guild_id: int) -> int:
+    """
+    Moves a guild's pending unmutes from the legacy sorted set (see keys.legacy_timeouts) into the current layout. The
+    legacy set only held unmute times, so that's all the migrated hashes hold. Timeouts already recorded in the current
+    layout are kept.
+    :return: The number of timeouts that were migrated (rather than kept).
+    """
+    legacy_key = keys.legacy_timeouts(guild_id)
+    legacy = await get_redis().zrange(legacy_key, 0, -1, withscores=True)
+    if not legacy:
+        return 0
+
+    commands = [("ZADD", keys.timeouts(guild_id), "NX", *(item for member, score in legacy for item in (score, member)))]
+    for member, score in legacy:
+        timeout_key = keys.timeout(guild_id, int(member))
+        commands.append(("HSETNX", timeout_key, "unmute_at", score))
+        commands.append(("EXPIREAT", timeout_key, _expire_at(score)))
+    # Only the members that were read are removed, in case a process on the old layout is still recording timeouts.
+    commands.append(("ZREM", legacy_key, *(member for member, _ in legacy)))
+    migrated, *_ = await pipelined(*commands, transaction=True)
+
+    logger.info("Migrated %s pending unmutes for guild %s to schema version %s", migrated, guild_id, keys.SCHEMA_VERSION)
+    return migrated
+
+
+def _expire_at(unmute_at: float) -> int:
+    return int(unmute_at) + _EXPIRE_AFTER_SECONDS
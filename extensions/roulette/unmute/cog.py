@@ -1,117 +1,388 @@
-import math
+import asyncio
 import logging
+import time
 
-from .debounce import should_debounce
+from .scheduler import UnmuteScheduler
 
-from ..config import config
+from .. import keys, metrics, shards, timeouts
+from ..config import settings
 from ..roles.roles import get_timeout_role
 
 from api_extensions import guilds, members
 from database.redis_client import get_redis
-from datetime import datetime, timedelta, timezone
-from discord import Forbidden, HTTPException
-from discord.ext import tasks
+from datetime import datetime, timezone
+from discord import ClientException, Forbidden, Guild, HTTPException, Member, Role
 from discord.ext.commands import Bot, Cog
-from typing import List
+from telemetry.tracing import span, trace
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-_redis_client = get_redis()
+# Discord allows up to 100 user IDs per gateway member query.
+_QUERY_MEMBERS_LIMIT = 100
+# Time in seconds between reconciling each scheduler with Redis.
+_RECONCILE_SECONDS = 300
+# Time in seconds before the first retry of a failed reconcile. Later retries back off, up to _RECONCILE_SECONDS.
+_RECONCILE_RETRY_SECONDS = 5
 
 
 class Unmute(Cog):
+    """
+    Removes the timeout role when each timeout expires.
+
+    Unmute work is partitioned by shard: this process only unmutes members of the configured guilds on its own shards,
+    with one scheduler (and one background task) per shard.
+    """
+
     def __init__(self, bot: Bot):
         self.bot = bot
         self.logger = logging.getLogger("roulette.unmute")
-        self.unmute_loop.start()
+        # Schedulers for each shard this process runs, keyed by shard ID. Created once the bot is ready.
+        self.schedulers: Dict[int, UnmuteScheduler] = dict()
+        self._tasks: List[asyncio.Task] = list()
         self.logger.info("Loaded Unmute cog")
 
+    async def cog_load(self) -> None:
+        self._tasks.append(asyncio.create_task(self._start()))
+
+    async def cog_unload(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
     async def cog_command_error(self, ctx, error: Exception) -> None:
         self.logger.error(error)
 
-    @tasks.loop(minutes=config.unmute_rate())
-    async def unmute_loop(self):
-        # TODO: Investigate if the unmute function can be executed within a transaction or a lock.
-        # This is low-priority, since we assume each server only has one bot running for it.
-        # discord.py can enqueue all loop events that failed, due to system sleep / etc.
-        if should_debounce():
-            self.logger.info("Skipping unmute loop due to debounce")
+    @Cog.listener()
+    async def on_roulette_timeout_recorded(self, guild_id: int, member_id: int, unmute_time: datetime):
+        """
+        Dispatched by the Roll cog whenever a timeout is written to Redis.
+        """
+        scheduler = self._scheduler_for(guild_id)
+        if scheduler is None:
+            # Either the guild is on another process' shard, or the schedulers haven't been created yet.
             return
+        scheduler.schedule((guild_id, member_id), unmute_time.timestamp())
+        self.logger.debug("Scheduled unmute for user %s at %s", member_id, unmute_time)
+
+    async def _start(self):
+        """
+        Starts a scheduler for each shard this process runs, once the shards are known.
+        """
+        await self.bot.wait_until_ready()
+        shard_ids = shards.local_shard_ids(self.bot)
+        for shard_id in shard_ids:
+            self.schedulers[shard_id] = UnmuteScheduler()
+        self._tasks.extend(asyncio.create_task(self._run(shard_id)) for shard_id in shard_ids)
+        self.logger.info("Started unmute schedulers for shard(s) %s of %s",
+                         ", ".join(str(i) for i in shard_ids), shards.shard_count(self.bot))
+
+    async def _run(self, shard_id: int):
+        """
+        Sleeps until the shard's next unmute deadline, then unmutes every member that is due, for as long as the cog is
+        loaded. The scheduler is seeded from Redis in the background, so a Redis outage at startup only delays unmutes.
+        """
+        scheduler = self.schedulers[shard_id]
+        self._tasks.append(asyncio.create_task(self._reconcile(shard_id)))
 
-        unmute_candidates = await self._fetch_unmute_candidates()
-        if unmute_candidates:
-            self.logger.info(f"Now processing unmute candidates: {unmute_candidates}")
+        while True:
+            await scheduler.wait()
             try:
-                for candidate in unmute_candidates:
-                    await self._remove_timeout_role(candidate)
-                    self.logger.info(f"Finished processing candidate: {candidate}")
-            except RuntimeError as e:
+                await self.unmute_tick(shard_id)
+            except Exception as e:
+                # Keep the scheduler alive - Redis still holds every pending unmute, so they'll be retried.
+                self.logger.critical("Unmute tick failed on shard %s: %s", shard_id, e)
+                self._schedule_retry(scheduler, scheduler.pop_due(time.time()))
+
+    async def _reconcile(self, shard_id: int):
+        """
+        Seeds the shard's scheduler from Redis (e.g. with the unmutes recorded before a restart), then periodically
+        schedules any pending unmute that's missing from it (e.g. one whose event was missed), for as long as the cog is
+        loaded. Failures are retried with exponential backoff.
+
+        Only the first pass reads every pending unmute. Later passes only read the unmutes due before the next pass, so
+        their cost scales with the number of upcoming unmutes rather than the number of muted members. Unmutes further
+        out are picked up by a later pass, before they're due.
+        """
+        seeded = False
+        delay = _RECONCILE_RETRY_SECONDS
+        while True:
+            until = time.time() + _RECONCILE_SECONDS if seeded else float("inf")
+            try:
+                scheduled = await self._schedule_pending(shard_id, until)
+            except Exception as e:
+                self.logger.critical("Unable to load pending unmutes for shard %s, retrying in %ss: %s",
+                                     shard_id, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _RECONCILE_SECONDS)
+                continue
+
+            delay = _RECONCILE_RETRY_SECONDS
+            if not seeded:
+                seeded = True
+                self.logger.info("Seeded unmute scheduler for shard %s with %s pending unmutes", shard_id, scheduled)
+            elif scheduled:
+                self.logger.warning("Scheduled %s pending unmutes on shard %s that were missing from the scheduler",
+                                    scheduled, shard_id)
+            await asyncio.sleep(_RECONCILE_SECONDS)
+
+    def _guild_ids(self, shard_id: int) -> List[int]:
+        """
+        :return: The configured guilds that belong to a shard.
+        """
+        count = shards.shard_count(self.bot)
+        return [s.guild_id for s in settings.guilds() if shards.shard_for(s.guild_id, count) == shard_id]
+
+    def _scheduler_for(self, guild_id: int) -> Optional[UnmuteScheduler]:
+        return self.schedulers.get(shards.shard_for(guild_id, shards.shard_count(self.bot)))
+
+    async def _schedule_pending(self, shard_id: int, until: float) -> int:
+        """
+        Schedules every pending unmute of the shard's guilds in Redis that isn't already scheduled. Unmutes that are
+        already scheduled keep their deadline, which may be a later retry.
+        :param until: The latest unmute time to include, as a POSIX timestamp. Use infinity to include every unmute.
+        :return: The number of unmutes that were scheduled.
+        """
+        scheduler = self.schedulers[shard_id]
+        scheduled = 0
+        for guild_id in self._guild_ids(shard_id):
+            member_ids = list()
+            async for page in self._iter_due_pages(keys.timeouts(guild_id), until):
+                for user, unmute_time in page:
+                    member_id = int(user.decode("utf-8"))
+                    if (guild_id, member_id) not in scheduler:
+                        member_ids.append(member_id)
+                        scheduler.schedule((guild_id, member_id), unmute_time)
+            scheduled += len(member_ids)
+
+            # Members aren't chunked at startup with the lean gateway profile. Cache the members that will be unmuted.
+            if member_ids and (guild := self.bot.get_guild(guild_id)) and not guild.chunked:
+                await self._query_members(guild, [i for i in member_ids if not guild.get_member(i)])
+        return scheduled
+
+    async def unmute_tick(self, shard_id: int = 0):
+        """
+        Unmutes every member that is due on a shard. Redis is the source of truth for who is due, the scheduler only
+        decides when. Each guild with due members is handled concurrently, and a failure in one guild doesn't affect
+        the others.
+        :param shard_id: The shard to unmute members on.
+        """
+        scheduler = self.schedulers[shard_id]
+        due = scheduler.pop_due(time.time())
+        guild_ids = list(dict.fromkeys(guild_id for guild_id, _ in due))
+
+        slow_seconds = settings.current().slow_trace_seconds
+        with metrics.UNMUTE_TICK.time(shard=shard_id), trace(f"unmute tick on shard {shard_id}", slow_seconds):
+            results = await asyncio.gather(*(self._unmute_guild(guild_id) for guild_id in guild_ids),
+                                           return_exceptions=True)
+        for guild_id, result in zip(guild_ids, results):
+            if isinstance(result, Exception):
+                self.logger.critical("Unable to process unmutes for guild %s: %s", guild_id, result)
+                self._schedule_retry(scheduler, [key for key in due if key[0] == guild_id])
+            elif result:
                 # TODO: Specify a warning channel to send failures to.
-                self.logger.critical(e)
-        else:
-            self.logger.debug("No unmute candidates for this loop.")
+                self._schedule_retry(scheduler, [(guild_id, member_id) for member_id in result])
 
-    @unmute_loop.before_loop
-    async def before_unmute_loop(self):
-        await self.bot.wait_until_ready()
+    async def _unmute_guild(self, guild_id: int) -> List[int]:
+        """
+        Unmutes every member of a guild that is due.
 
-    async def _fetch_unmute_candidates(self) -> List[int]:
+        The guild and timeout role are resolved once, members are prefetched in bulk, and roles are removed with bounded
+        concurrency. A failure only affects its own member, who is retried later. Every member that was handled is
+        removed from Redis in a single round trip.
+        :return: The members that couldn't be unmuted.
+        """
+        # TODO: Investigate if the unmute function can be executed within a transaction or a lock.
+        # This is low-priority, since we assume each server only has one bot running for it.
+        with span("candidates"):
+            unmute_candidates = await self._fetch_unmute_candidates(guild_id)
+        if not unmute_candidates:
+            self.logger.debug("No unmute candidates for guild %s.", guild_id)
+            return list()
+
+        with span("guild"):
+            guild = await guilds.get_guild(guild_id, self.bot)
+        if not guild:
+            raise RuntimeError(f"Guild {guild_id} was not loaded. Please check your environment.")
+
+        with span("role"):
+            role = await get_timeout_role(guild)
+        if not role:
+            raise RuntimeError("Timeout role doesn't seem to exist. Please check your config.")
+
+        self.logger.info("Now processing %s unmute candidates: %s", len(unmute_candidates), unmute_candidates)
+        semaphore = asyncio.Semaphore(settings.current(guild_id).unmute_concurrency)
+        with span("members"):
+            resolved = await self._prefetch_members(guild, unmute_candidates, semaphore)
+        with span("unmute"):
+            results = await asyncio.gather(
+                *(self._unmute_member(member_id, resolved, role, semaphore) for member_id in unmute_candidates))
+
+        finished = [member_id for member_id, ok in zip(unmute_candidates, results) if ok]
+        failed = [member_id for member_id, ok in zip(unmute_candidates, results) if not ok]
+        if finished:
+            with span("redis"):
+                resp = await timeouts.remove(guild_id, finished)
+            # Even if the role was already removed, Redis still should be updated.
+            if resp != len(finished):
+                self.logger.warning("%s members were removed from Redis, when %s were expected.", resp, len(finished))
+
+        self.logger.info("Finished processing %s unmute candidates (%s failed)", len(finished), len(failed))
+        return failed
+
+    def _schedule_retry(self, scheduler: UnmuteScheduler, scheduled: List[Tuple[int, int]]):
+        """
+        Reschedules unmutes that failed, after unmute_rate minutes.
+        :param scheduled: The unmutes to retry, as (guild ID, member ID) tuples.
+        """
+        if not scheduled:
+            return
+        retry_at = time.time() + settings.current().unmute_rate * 60
+        for key in scheduled:
+            scheduler.schedule(key, retry_at)
+        self.logger.warning("Retrying %s unmutes in %s minute(s)", len(scheduled), settings.current().unmute_rate)
+
+    async def _fetch_unmute_candidates(self, guild_id: int) -> List[int]:
         """
         :return: A list of users that should be unmuted. This can be empty if no users should be unmuted.
         """
         # Data is referenced in UTC time.
         posix_time_now = datetime.now(timezone.utc)
-
-        zrange_end = posix_time_now + timedelta(minutes=1)
-        data = _redis_client.zrange(name=config.guild(),
-                                    start=0,
-                                    # Must be an int, so cast up to avoid missing anyone.
-                                    end=math.ceil(zrange_end.timestamp()),
-                                    withscores=True)
+        self.logger.debug("Current time: %s (%s)", posix_time_now.timestamp(), posix_time_now)
 
         candidates = list()
-        self.logger.debug(f"Current time: {posix_time_now.timestamp()} ({posix_time_now.strftime('%c')}) UTC")
-        for user, time in data:
-            # User is a bytestring
-            user_id = user.decode("utf-8")
+        async for page in self._iter_due_pages(keys.timeouts(guild_id), posix_time_now.timestamp()):
+            for user, unmute_time in page:
+                # User is a bytestring
+                user_id = int(user.decode("utf-8"))
+                self.logger.debug("Added user %s (unmute time %s) to unmute candidate queue.", user_id, unmute_time)
+                candidates.append(user_id)
 
-            self.logger.debug(
-                f"User {user_id} has an unmute time of {time} ({datetime.fromtimestamp(time).strftime('%c')}) UTC")
+        self.logger.debug("Enqueue unmute candidates: %s", candidates)
+        return candidates
 
-            if time <= posix_time_now.timestamp():
-                self.logger.debug(f"Added user {user_id} to unmute candidate queue.")
-                candidates.append(int(user_id))
+    @staticmethod
+    async def _iter_due_pages(key: str, until: float) -> AsyncIterator[List[Tuple[bytes, float]]]:
+        """
+        Pages through all members whose unmute time (score) is at or before until, in batches of unmute_batch_size.
+        Only due members are read, so the cost of each tick scales with the number of due members rather than the number
+        of muted members.
 
-        self.logger.debug(f"Enqueue unmute candidates: {candidates}")
-        return candidates
+        Each page continues from the last score seen (a cursor), skipping the members already read at exactly that score.
+        Members shouldn't be removed from the set while paging, since that would shift the cursor.
+        :param key: The sorted set to read from.
+        :param until: The latest unmute time to include, as a POSIX timestamp. Use infinity to include every member.
+        :return: Pages of (member, unmute time) tuples, in order of unmute time.
+        """
+        batch_size = settings.current().unmute_batch_size
+        min_score: float | str = "-inf"
+        offset = 0
+        while True:
+            page = await get_redis().zrangebyscore(key,
+                                                   min=min_score,
+                                                   max=until,
+                                                   start=offset,
+                                                   num=batch_size,
+                                                   withscores=True)
+            if page:
+                yield page
+            if len(page) < batch_size:
+                return
 
-    async def _remove_timeout_role(self, member_id: int):
-        guild = await guilds.get_guild(config.guild(), self.bot)
-        if not guild:
-            raise RuntimeError(f"Guild {config.guild()} was not loaded. Please check your environment.")
+            last_score = page[-1][1]
+            seen_at_last_score = sum(1 for _, score in page if score == last_score)
+            offset = (offset if last_score == min_score else 0) + seen_at_last_score
+            min_score = last_score
+
+    async def _prefetch_members(self,
+                                guild: Guild,
+                                member_ids: List[int],
+                                semaphore: asyncio.Semaphore) -> Dict[int, Optional[Member]]:
+        """
+        Resolves all members that are about to be unmuted, from the cache where possible.
+        Cache misses are requested over the gateway in chunks (if the members intent is enabled), and any remaining misses
+        are fetched from the API concurrently.
+        :return: A mapping of member IDs to members. Members that don't exist map to None, and members that couldn't be
+            fetched (e.g. due to an API error) are omitted.
+        """
+        resolved: Dict[int, Optional[Member]] = {
+            member_id: member for member_id in member_ids if (member := guild.get_member(member_id))
+        }
+
+        missing = [member_id for member_id in member_ids if member_id not in resolved]
+        if missing:
+            resolved.update((member.id, member) for member in await self._query_members(guild, missing))
+            missing = [member_id for member_id in member_ids if member_id not in resolved]
+
+        async def fetch(member_id: int):
+            async with semaphore:
+                try:
+                    resolved[member_id] = await members.get_member(member_id, guild)
+                except RuntimeError as e:
+                    self.logger.critical(e)
+
+        await asyncio.gather(*(fetch(member_id) for member_id in missing))
+        return resolved
+
+    async def _query_members(self, guild: Guild, member_ids: List[int]) -> List[Member]:
+        """
+        Requests members over the gateway (in chunks), and caches them. Does nothing without the members intent.
+        :return: The members that were found.
+        """
+        found = list()
+        if not self.bot.intents.members:
+            return found
 
-        member = await members.get_member(member_id, guild)
+        for start in range(0, len(member_ids), _QUERY_MEMBERS_LIMIT):
+            chunk = member_ids[start:start + _QUERY_MEMBERS_LIMIT]
+            try:
+                found.extend(await guild.query_members(user_ids=chunk, limit=len(chunk), cache=True))
+            except (asyncio.TimeoutError, ClientException) as e:
+                self.logger.warning("Unable to query %s members over the gateway: %s", len(chunk), e)
+        return found
+
+    async def _unmute_member(self,
+                             member_id: int,
+                             resolved: Dict[int, Optional[Member]],
+                             role: Role,
+                             semaphore: asyncio.Semaphore) -> bool:
+        """
+        Removes the timeout role from a single member. Failures are logged, rather than raised.
+        :param member_id: The ID of the member to unmute.
+        :param resolved: The prefetched members (see _prefetch_members).
+        :param role: The timeout role.
+        :return: Whether the member was handled, and can be removed from Redis.
+        """
+        if member_id not in resolved:
+            # The lookup itself failed (e.g. an API error), so try again later.
+            return False
+
+        member = resolved[member_id]
         if not member:
-            self.logger.warning(f"Member {member_id} could not be found. Not removing timeout role.")
-            return
+            # Members that leave the guild lose their roles, so there's nothing left to remove.
+            self.logger.warning("Member %s could not be found. Not removing timeout role.", member_id)
+            return True
 
-        role = await get_timeout_role(guild)
+        async with semaphore:
+            try:
+                await self._remove_timeout_role(member, role)
+            except RuntimeError as e:
+                self.logger.critical("Unable to unmute member %s: %s", member_id, e)
+                return False
+
+        self.logger.info("Finished processing candidate: %s", member_id)
+        return True
+
+    async def _remove_timeout_role(self, member: Member, role: Role):
         try:
             # Note: If the role was already removed (e.g. by a moderator), this will simply not do anything.
             if role in member.roles:
                 await member.remove_roles(role)
-                self.logger.debug(f"Removed timeout role from user {member_id} ({member.name})")
+                self.logger.debug("Removed timeout role from user %s (%s)", member.id, member.name)
             else:
-                self.logger.info(
-                    f"Member {member.id} ({member.name}) doesn't have the timeout role. It may have already been removed.")
+                self.logger.info("Member %s (%s) doesn't have the timeout role. It may have already been removed.",
+                                 member.id, member.name)
         except Forbidden as e:
-            self.logger.critical(f"Bot does not have sufficient permissions to remove the timeout role.")
+            self.logger.critical("Bot does not have sufficient permissions to remove the timeout role.")
             raise RuntimeError(e)
         except HTTPException as e:
-            self.logger.critical(f"Unknown exception occurred when removing the timeout role. Please check your env.")
+            self.logger.critical("Unknown exception occurred when removing the timeout role. Please check your env.")
             raise RuntimeError(e)
-
-        resp = _redis_client.zrem(config.guild(), str(member_id))
-        # Even if the role was already removed, Redis still should be updated.
-        if resp != 1:
-            raise RuntimeError(f"{resp} members were removed from Redis, when 1 was expected!")
-
-        return
@@ -0,0 +1,87 @@
+import asyncio
+import heapq
+import logging
+import time
+
+from typing import Dict, List, Optional, Tuple
+
+# A scheduled unmute: (guild ID, member ID).
+Key = Tuple[int, int]
+
+logger = logging.getLogger("roulette.unmute")
+
+
+class UnmuteScheduler:
+    """
+    An in-memory min-heap of upcoming unmute deadlines, used to wake the Unmute cog exactly when a timeout expires.
+
+    Redis remains the durable source of truth: the heap is seeded (and periodically reconciled) from Redis, and only
+    decides *when* to check Redis for due members. Deadlines are POSIX timestamps, matching the scores stored in Redis.
+    Members are keyed by (guild ID, member ID), so one scheduler can serve every guild on a shard.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, Key]] = list()
+        # The latest deadline for each member. Heap entries that don't match this are stale, and skipped lazily.
+        self._deadlines: Dict[Key, float] = dict()
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: Key, deadline: float) -> None:
+        """
+        Schedules (or reschedules) a member's unmute.
+        :param key: The member to unmute, as (guild ID, member ID).
+        :param deadline: When to unmute the member, as a POSIX timestamp.
+        """
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, (deadline, key))
+        # Only wake the waiter if this is now the earliest deadline. Otherwise, it's already sleeping long enough.
+        if self._heap[0] == (deadline, key):
+            self._changed.set()
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        :return: The earliest scheduled deadline, or None if nothing is scheduled.
+        """
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> List[Key]:
+        """
+        Removes and returns all members whose deadline is at or before now.
+        :param now: The current time, as a POSIX timestamp.
+        :return: The due members, in order of their deadlines.
+        """
+        due = list()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, key = heapq.heappop(self._heap)
+            if self._deadlines.get(key) == deadline:
+                del self._deadlines[key]
+                due.append(key)
+        return due
+
+    async def wait(self) -> None:
+        """
+        Sleeps until the earliest deadline has passed. If an earlier deadline is scheduled in the meantime, the sleep is
+        shortened to match it. If nothing is scheduled, sleeps until something is.
+        """
+        while True:
+            self._changed.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else deadline - time.time()
+            if timeout is not None and timeout <= 0:
+                return
+
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    def _discard_stale(self) -> None:
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
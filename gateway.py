@@ -0,0 +1,87 @@
+"""
+Gateway connection profiles: which intents the bot requests, and how much state discord.py keeps in memory.
+
+"default": Discord.py's default intents (plus message content), with its default member and message caching.
+"lean": Only the state roulette needs. The bot receives guild (including role), guild message and member events,
+    doesn't chunk guild members at startup and doesn't cache members as they're seen. Members are cached lazily: those
+    with a pending unmute are requested at startup, and others are only cached once they're explicitly requested.
+"""
+import config
+import discord
+import logging
+import os
+import resource
+import sys
+
+from discord import Client, Intents, MemberCacheFlags
+from typing import Any, Dict
+
+logger = logging.getLogger("gateway")
+
+
+def intents() -> Intents:
+    """
+    :return: The intents for the configured profile.
+    """
+    if config.bot_gateway_profile() == "lean":
+        selected = Intents.none()
+        # Guild events also carry roles and channels, which the bot needs to resolve its settings.
+        selected.guilds = True
+        selected.guild_messages = True
+        selected.members = True
+    else:
+        selected = Intents.default()
+    selected.message_content = True
+    return selected
+
+
+def member_cache_flags(selected: Intents) -> MemberCacheFlags:
+    """
+    :return: The member cache flags for the configured profile.
+    """
+    if config.bot_gateway_profile() == "lean":
+        return MemberCacheFlags.none()
+    return MemberCacheFlags.from_intents(selected)
+
+
+def client_options() -> Dict[str, Any]:
+    """
+    :return: The gateway and cache keyword arguments for the Bot constructor.
+    """
+    selected = intents()
+    lean = config.bot_gateway_profile() == "lean"
+    return {
+        "intents": selected,
+        "member_cache_flags": member_cache_flags(selected),
+        "max_messages": config.bot_max_messages(200 if lean else 1000),
+        "chunk_guilds_at_startup": selected.members and not lean
+    }
+
+
+def resident_memory_bytes() -> int:
+    """
+    :return: The current resident memory of this process, or its peak if the current value isn't available.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def log_report(bot: Client) -> None:
+    """
+    Logs the process' resident memory and the size of discord.py's caches, e.g. to help size containers.
+    """
+    memory = resident_memory_bytes()
+    members = sum(len(guild.members) for guild in bot.guilds)
+    roles = sum(len(guild.roles) for guild in bot.guilds)
+    channels = sum(len(guild.channels) for guild in bot.guilds)
+    logger.info("Gateway profile %s (intents %s, discord.py %s): resident memory %.1f MiB, %s guilds, "
+                "%s cached members, %s cached users, %s roles, %s channels, %s cached messages",
+                config.bot_gateway_profile(), bot.intents.value, discord.__version__, memory / 2 ** 20,
+                len(bot.guilds), members, len(bot.users), roles, channels, len(bot.cached_messages))
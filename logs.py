@@ -0,0 +1,80 @@
+"""
+Logging setup for the bot.
+
+Log records are put on a queue by the thread that logs them (usually the event loop's), and written out by a separate
+thread, so slow output (e.g. a busy terminal or a full pipe) never blocks the event loop.
+
+High-volume DEBUG events can be sampled (see log_debug_sample_rate), keeping one in every N records of each event.
+"""
+import atexit
+import config
+import logging
+import queue
+
+from cachetools import LRUCache
+from colorlog import ColoredFormatter
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Tuple
+
+# The number of distinct DEBUG events whose counts are kept. Once exceeded, the least recently logged event is forgotten
+# (and sampling restarts for it).
+_SAMPLED_EVENTS = 1000
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keeps one in every rate DEBUG records of each event. Events are told apart by their logger and message template
+    (e.g. "Ignoring message (no match): %s"), so each kind of event is sampled separately.
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._seen: LRUCache[Tuple[str, str], int] = LRUCache(maxsize=_SAMPLED_EVENTS)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate <= 1:
+            return True
+        key = (record.name, str(record.msg))
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        return seen % self.rate == 0
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure() -> None:
+    """
+    Configures the root logger, so all loggers have the same general output, and starts the writer thread.
+    """
+    global _listener
+    formatter = ColoredFormatter(
+        "%(log_color)s%(levelname)-8s%(reset)s %(blue)s%(message)s",
+        datefmt=None,
+        reset=True,
+        log_colors={
+            'DEBUG': 'white',
+            'INFO': 'cyan',
+            'WARNING': 'yellow',
+            'ERROR': 'red',
+            'CRITICAL': 'red,bg_white'
+        },
+        secondary_log_colors={},
+        style='%'
+    )
+    stream = logging.StreamHandler()
+    stream.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(DebugSampler(config.log_debug_sample_rate()))
+    logging.root.addHandler(handler)
+    logging.root.setLevel(config.log_level())
+    # Note: Discord.py logs through the root logger too - keep it at INFO, since its DEBUG output is very verbose.
+    logging.getLogger("discord").setLevel(logging.INFO)
+
+    _listener = QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    # Flush the remaining records on exit.
+    atexit.register(_listener.stop)
@@ -1,45 +1,52 @@
 import config
-import discord
+import gateway
 import logging
+import logs
 
-from colorlog import ColoredFormatter
-from discord.ext.commands import Bot
-
-
-intents = discord.Intents.default()
-intents.message_content = True
-
-formatter = ColoredFormatter(
-    "%(log_color)s%(levelname)-8s%(reset)s %(blue)s%(message)s",
-    datefmt=None,
-    reset=True,
-    log_colors={
-        'DEBUG': 'white',
-        'INFO': 'cyan',
-        'WARNING': 'yellow',
-        'ERROR': 'red',
-        'CRITICAL': 'red,bg_white'
-    },
-    secondary_log_colors={},
-    style='%'
-)
-
-# Configure the root logger so all loggers have the same general output.
-stream = logging.StreamHandler()
-stream.setFormatter(formatter)
-logging.root.addHandler(stream)
-logging.root.setLevel(config.log_level())
+from discord.ext.commands import AutoShardedBot, Bot
+
+# Log records are written by a separate thread, so logging never blocks the event loop.
+logs.configure()
 
 logger = logging.getLogger(__name__)
 
-bot = Bot(command_prefix="roll", intents=intents)
+_EXTENSIONS = ("extensions.roulette.extension",)
+
+
+class _StartupMixin:
+    async def setup_hook(self) -> None:
+        """
+        Called once by Discord.py, after logging in but before connecting to the gateway. Unlike on_ready, this never
+        runs again on reconnects, so extensions are loaded exactly once.
+        """
+        for extension in _EXTENSIONS:
+            if extension not in self.extensions:
+                await self.load_extension(extension)
+
+
+class RouletteBot(_StartupMixin, Bot):
+    pass
+
+
+class ShardedRouletteBot(_StartupMixin, AutoShardedBot):
+    pass
+
+
+if config.bot_sharded():
+    # Splits the gateway connection into shards. Several processes can each run a subset of the shards (bot_shard_ids).
+    bot = ShardedRouletteBot(command_prefix="roll",
+                             shard_count=config.bot_shard_count(),
+                             shard_ids=config.bot_shard_ids(),
+                             **gateway.client_options())
+else:
+    bot = RouletteBot(command_prefix="roll", **gateway.client_options())
 
 
 @bot.event
 async def on_ready():
-    logger.info(f'Logged in as {bot.user}')
-    await bot.load_extension("extensions.roulette.extension")
+    logger.info("Logged in as %s", bot.user)
+    gateway.log_report(bot)
 
 if __name__ == '__main__':
-    # Note: Discord.py configures its own logger [prior to the root logger] - keep this at INFO.
-    bot.run(config.bot_token(), log_handler=stream, log_level=logging.INFO)
+    # Discord.py's own log handler would write on the event loop, so its records go through the root logger instead.
+    bot.run(config.bot_token(), log_handler=None)
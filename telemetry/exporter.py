@@ -0,0 +1,70 @@
+"""
+A small HTTP server that exports the metrics registry, for Prometheus to scrape.
+"""
+import asyncio
+import config
+import logging
+import threading
+
+from . import profiler
+from .metrics import REGISTRY
+from aiohttp import web
+from typing import Optional
+
+_CONTENT_TYPE = "text/plain; version=0.0.4"
+
+logger = logging.getLogger("telemetry")
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start_exporter() -> None:
+    """
+    Starts serving /metrics on metrics_host:metrics_port. Does nothing if metrics_port isn't set.
+    """
+    global _runner
+    port = config.metrics_port()
+    if not port or _runner:
+        return
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics)
+    if config.metrics_profiler():
+        app.router.add_get("/debug/profile", _profile)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, config.metrics_host(), port).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", config.metrics_host(), port)
+    if config.metrics_profiler():
+        logger.warning("Serving the sampling profiler on http://%s:%s/debug/profile", config.metrics_host(), port)
+
+
+async def stop_exporter() -> None:
+    global _runner
+    if _runner:
+        await _runner.cleanup()
+    _runner = None
+
+
+async def _metrics(_: web.Request) -> web.Response:
+    return web.Response(body=(await REGISTRY.render()).encode(), headers={"Content-Type": _CONTENT_TYPE})
+
+
+async def _profile(request: web.Request) -> web.Response:
+    """
+    Profiles the event loop for ?seconds=N (default 30), and responds with the samples as folded stacks.
+    Example: curl "http://127.0.0.1:9100/debug/profile?seconds=60" > roulette.folded && flamegraph.pl roulette.folded
+    """
+    try:
+        seconds = float(request.query.get("seconds", 30))
+    except ValueError:
+        raise web.HTTPBadRequest(text="seconds must be a number")
+    if not 0 < seconds <= profiler.MAX_SECONDS:
+        raise web.HTTPBadRequest(text=f"seconds must be between 0 and {profiler.MAX_SECONDS}")
+
+    # The sampler runs on another thread, so the loop keeps running (and is what gets sampled).
+    try:
+        folded = await asyncio.to_thread(profiler.profile, threading.get_ident(), seconds)
+    except RuntimeError as e:
+        raise web.HTTPConflict(text=str(e))
+    return web.Response(text=folded, headers={"Content-Disposition": 'attachment; filename="roulette.folded"'})
@@ -0,0 +1,68 @@
+"""
+An opt-in sampling profiler, for diagnosing hot spots in production without redeploying.
+
+While profiling, a background thread samples the event loop thread's stack at a fixed interval. Samples are written
+in the folded stack format (one "frame;frame;frame count" line per distinct stack), which flamegraph.pl, speedscope and
+similar tools can render as a flame graph.
+
+Profiling is served by the metrics exporter at /debug/profile?seconds=N when metrics_profiler is enabled.
+"""
+import collections
+import logging
+import sys
+import threading
+import time
+
+from types import FrameType
+from typing import Counter, Tuple
+
+# Profiling windows are capped, since the sampler holds one entry per distinct stack.
+MAX_SECONDS = 300
+
+logger = logging.getLogger("telemetry.profiler")
+
+_lock = threading.Lock()
+
+
+def profile(thread_id: int, seconds: float, interval: float = 0.005) -> str:
+    """
+    Samples a thread's stack for a time window. Blocks the calling thread, so call it from another thread than the
+    one being profiled (e.g. with asyncio.to_thread).
+    :param thread_id: The thread to sample, e.g. the event loop's (threading.get_ident() on the loop).
+    :param seconds: How long to sample for, up to MAX_SECONDS.
+    :param interval: Time between samples, in seconds.
+    :return: The samples, in the folded stack format.
+    """
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already being taken")
+
+    try:
+        seconds = min(seconds, MAX_SECONDS)
+        logger.info("Profiling thread %s for %ss", thread_id, seconds)
+        stacks: Counter[Tuple[str, ...]] = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stacks[_stack(frame)] += 1
+            del frame
+            time.sleep(interval)
+    finally:
+        _lock.release()
+
+    logger.info("Finished profiling: %s samples, %s distinct stacks", sum(stacks.values()), len(stacks))
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+def _stack(frame: FrameType) -> Tuple[str, ...]:
+    """
+    :return: The frame's stack, from the outermost frame to the frame itself.
+    """
+    names = list()
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}")
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
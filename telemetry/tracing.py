@@ -0,0 +1,94 @@
+"""
+Lightweight tracing, to find which stage of a request is slow.
+
+A trace covers one request (e.g. handling a message), and spans time the stages within it. Spans are summed per stage,
+so a stage that runs several times (e.g. once per target) is reported once, with its total time and count. The current
+trace is held in a context variable, so it follows the request into the tasks it gathers. Spans outside a trace cost a
+single context variable lookup.
+
+When a trace takes longer than its threshold, its breakdown is logged.
+"""
+import logging
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Iterator, List, Optional, TypeVar
+
+logger = logging.getLogger("telemetry.tracing")
+
+T = TypeVar("T")
+
+
+class Trace:
+    __slots__ = ("name", "started", "spans")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        # Per stage: [total seconds, count]. Stages are kept in the order they first ran.
+        self.spans: Dict[str, List[float]] = dict()
+
+    def add(self, stage: str, seconds: float) -> None:
+        totals = self.spans.get(stage)
+        if totals is None:
+            self.spans[stage] = [seconds, 1]
+        else:
+            totals[0] += seconds
+            totals[1] += 1
+
+    def breakdown(self) -> str:
+        """
+        :return: Each stage's total time, e.g. "permissions 0.1ms, delay 2003.4ms, edit 812.0ms x3".
+        """
+        return ", ".join(f"{stage} {seconds * 1000:.1f}ms" + (f" x{count:.0f}" if count > 1 else "")
+                         for stage, (seconds, count) in self.spans.items())
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+@contextmanager
+def trace(name: str, slow_seconds: float = 0) -> Iterator[Trace]:
+    """
+    Traces a request. Stages are timed within it using span().
+    Example: with trace(f"message {message.id}", slow_seconds=5): ...
+    :param name: Describes the request in the slow request log.
+    :param slow_seconds: Requests taking at least this long have their breakdown logged. Disable by setting to 0.
+    """
+    current = Trace(name)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - current.started
+        if slow_seconds and elapsed >= slow_seconds:
+            logger.warning("Slow %s took %.1fms: %s", name, elapsed * 1000, current.breakdown() or 'no stages')
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Times a stage of the current trace. Does nothing outside a trace.
+    Example: with span("debounce"): ...
+    """
+    current = _current.get()
+    if current is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add(stage, time.perf_counter() - started)
+
+
+async def traced(stage: str, awaitable: Awaitable[T]) -> T:
+    """
+    Times an awaitable as a stage of the current trace, e.g. one of several that are gathered.
+    Example: await gather(traced("reply", message.reply(text)), traced("stats", record_stats()))
+    """
+    with span(stage):
+        return await awaitable
@@ -0,0 +1,139 @@
+"""
+An event loop watchdog, to catch and attribute calls that block the loop.
+
+A task on the loop wakes up every interval and records how late it woke up (the loop lag). Lag only becomes visible
+once the loop is free again, which is too late to see what blocked it, so a separate thread also watches the task's
+heartbeat: when the heartbeat is late by more than the threshold, the thread captures the loop thread's stack - the
+blocking call - while it's still running, and logs it.
+
+Lag is exported as a histogram, and as percentiles over the last minute.
+"""
+import asyncio
+import collections
+import config
+import logging
+import statistics
+import sys
+import threading
+import time
+import traceback
+
+from .metrics import REGISTRY, Counter, Gauge, Histogram
+from typing import Deque, Optional
+
+# Time between heartbeats, in seconds.
+_INTERVAL = 0.1
+# Number of lag samples kept for the percentiles (a minute's worth).
+_WINDOW = 600
+# Maximum number of stack frames logged for a blocking call, innermost last.
+_STACK_LIMIT = 25
+
+logger = logging.getLogger("telemetry.watchdog")
+
+LOOP_LAG = Histogram("event_loop_lag_seconds",
+                     "How late the event loop ran a task that was due, e.g. due to a blocking call.",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+
+LOOP_LAG_RECENT = Gauge("event_loop_lag_recent_seconds",
+                        "Event loop lag percentiles over the last minute.",
+                        labels=("quantile",))
+
+LOOP_STALLS = Counter("event_loop_stalls_total",
+                      "Times the event loop was blocked for longer than the watchdog threshold.")
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float):
+        """
+        :param threshold: Blocking calls that hold the loop for at least this long (in seconds) have their stack logged.
+        """
+        self.threshold = threshold
+        self._samples: Deque[float] = collections.deque(maxlen=_WINDOW)
+        self._beat = time.monotonic()
+        self._loop_thread_id = threading.get_ident()
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Starts watching the running event loop. Must be called from the loop's thread.
+        """
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        REGISTRY.add_collector(self.collect)
+
+    def stop(self) -> None:
+        REGISTRY.remove_collector(self.collect)
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def collect(self) -> None:
+        """
+        Exports the recent lag percentiles. Registered as a metrics collector.
+        """
+        samples = list(self._samples)
+        if len(samples) < 2:
+            return
+        percentiles = statistics.quantiles(samples, n=100, method="inclusive")
+        LOOP_LAG_RECENT.set(percentiles[49], quantile="0.5")
+        LOOP_LAG_RECENT.set(percentiles[98], quantile="0.99")
+        LOOP_LAG_RECENT.set(max(samples), quantile="1")
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + _INTERVAL
+            await asyncio.sleep(_INTERVAL)
+            lag = max(0.0, loop.time() - expected)
+            self._beat = time.monotonic()
+            self._samples.append(lag)
+            LOOP_LAG.observe(lag)
+
+    def _watch(self):
+        """
+        Runs on the watchdog thread. Logs the loop thread's stack once per stall.
+        """
+        reported_beat = None
+        while not self._stopped.wait(_INTERVAL):
+            beat = self._beat
+            stalled = time.monotonic() - beat - _INTERVAL
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+
+            reported_beat = beat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                return
+            stack = "".join(traceback.format_stack(frame, limit=_STACK_LIMIT))
+            del frame
+            LOOP_STALLS.inc()
+            logger.warning("Event loop blocked for at least %.0fms, in:\n%s", stalled * 1000, stack)
+
+
+_watchdog: Optional[LoopWatchdog] = None
+
+
+def start_watchdog() -> None:
+    """
+    Starts watching the running event loop for blocking calls. Does nothing if loop_watchdog_threshold_seconds is 0.
+    """
+    global _watchdog
+    threshold = config.loop_watchdog_threshold_seconds()
+    if not threshold or _watchdog:
+        return
+    _watchdog = LoopWatchdog(threshold)
+    _watchdog.start()
+    logger.info("Watching the event loop for calls blocking it for %.0fms or more", threshold * 1000)
+
+
+def stop_watchdog() -> None:
+    global _watchdog
+    if _watchdog:
+        _watchdog.stop()
+    _watchdog = None